@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Records per second for the old synchronous logging setup vs common.log.
+
+    python bench/bench_logging.py [--records 50000]
+
+"emit" is what the calling thread pays per record; "drained" includes the
+time for the background listener to write everything out. Output goes to
+/dev/null so the terminal is not part of the measurement.
+
+The comparison with the old setup runs with sampling off
+(LOG_SAMPLE_QUOTA=0), so both write every record. The sampled row uses the
+default quota; every benchmark record shares one message key, so it writes
+only that many and shows what the sampler costs when it drops the rest.
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import log  # noqa: E402
+
+
+def legacy_setup(stream):
+    """The formatter and handler the services used before common.log."""
+    from pythonjsonlogger import jsonlogger
+
+    class CustomJsonFormatter(jsonlogger.JsonFormatter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.hostname = socket.gethostname()
+
+        def add_fields(self, log_record, record, message_dict):
+            super().add_fields(log_record, record, message_dict)
+            log_record.update({
+                'timestamp': record.created, 'level': record.levelname, 'logger': record.name,
+                'service': 'bench', 'hostname': self.hostname, 'pod': self.hostname,
+                'namespace': 'default', 'version': '1.0.0', 'file': record.pathname,
+                'line': record.lineno, 'function': record.funcName,
+            })
+            if record.exc_info:
+                log_record['exception'] = traceback.format_exception(*record.exc_info)
+
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(CustomJsonFormatter('%(timestamp)s %(level)s [%(service)s] %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def shared_setup(stream, sample_quota):
+    """common.log with LOG_SAMPLE_QUOTA=sample_quota (0 turns sampling off)."""
+    os.environ['LOG_SAMPLE_QUOTA'] = str(sample_quota)
+    log.setup_logging('bench')
+    log._listener.handlers[0].setStream(stream)
+
+
+def run(records):
+    logger = logging.getLogger()
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info('Poster saved', extra={'component': 'downloader', 'movie_id': i, 'file': f'{i}.jpg'})
+    emitted = time.perf_counter() - start
+    if log._listener is not None:
+        log._flush()
+    return emitted, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=50000)
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull:
+        results = {}
+        try:
+            legacy_setup(devnull)
+            results['before (jsonlogger, sync)'] = run(args.records)
+        except ImportError:
+            print('python-json-logger not installed; skipping the baseline', file=sys.stderr)
+        shared_setup(devnull, 0)
+        results['after (common.log, queued)'] = run(args.records)
+        shared_setup(devnull, 50)
+        results['after, sampled (quota 50)'] = run(args.records)
+
+    for name, (emitted, drained) in results.items():
+        print(f"{name:28} emit {args.records / emitted:>10,.0f} rec/s   drained {args.records / drained:>10,.0f} rec/s")
+
+
+if __name__ == '__main__':
+    main()
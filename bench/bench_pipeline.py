@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""End-to-end throughput of main_job and process_posters, fully offline.
+
+    python bench/bench_pipeline.py [--sizes 100 1000 10000] [--latency-ms 0]
+        [--error-rate 0] [--throttle-rate 0] [--check bench/baseline.json]
+
+Local HTTP stand-ins replace TMDB (favorites, /images, /configuration and
+the image host) and the Telegram Bot API; they run in this process while
+every size runs the real services in its own subprocess, so the reported
+peak RSS is the services' alone. Redis is a throwaway redis-server when one
+is on PATH, otherwise an in-process fakeredis.
+
+Per size: one cold main_job (every favorite is new), --warm-cycles more
+(nothing new; the steady state), then process_posters until the queue is
+empty. Rate limits are lifted so the numbers measure our code, not the
+APIs' quotas; injected 429s still honour retry_after.
+
+Alongside the timings, each size counts the HTTP requests and Redis round
+trips the services make per favorite (cold job), per favorite and cycle
+(warm jobs) and per published poster. --check compares those counts with a
+baseline written by --write-baseline and exits 1 when any size regressed by
+more than --tolerance, so CI can use it as a gate: unlike throughput and
+RSS they do not depend on the machine that runs the benchmark.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import resource
+import subprocess
+import threading
+from urllib.parse import urlsplit, parse_qs, unquote_plus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_SIZE = 20
+# Work per item; the same on any machine, so these are what --check gates on.
+GATED_METRICS = ('ingest_http_per_favorite', 'ingest_redis_per_favorite', 'warm_http_per_favorite',
+                 'warm_redis_per_favorite', 'publish_http_per_poster', 'publish_redis_per_poster')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """TMDB and Telegram endpoints; the account id encodes the favorites count (bench<N>)."""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; without this, delayed ACKs add ~40 ms per response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fault(self):
+        """Apply the configured latency; returns True when an injected error was sent."""
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        roll = random.random()
+        if roll < server.throttle_rate:
+            self._reply(429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 1}})
+            return True
+        if roll < server.throttle_rate + server.error_rate:
+            self._reply(500, {'ok': False, 'error_code': 500})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts[:2] == ['3', 'configuration']:
+            base = f"http://{self.headers['Host']}/img/"
+            return self._reply(200, {'images': {'secure_base_url': base,
+                                                'poster_sizes': ['w92', 'w342', 'w500', 'original']}})
+        if self._fault():
+            return
+        if parts[:2] == ['3', 'account'] and len(parts) == 5:
+            total = int(parts[2].removeprefix('bench'))
+            count = total // 2 if parts[4] == 'movies' else total - total // 2
+            # Movie and tv ids overlap, as they do on TMDB.
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            ids = range(1 + (page - 1) * PAGE_SIZE, 1 + min(page * PAGE_SIZE, count))
+            return self._reply(200, {'page': page, 'total_pages': max(1, -(-count // PAGE_SIZE)),
+                                     'results': [{'id': i, 'vote_average': 7.5} for i in ids]})
+        if parts[0] == '3' and len(parts) == 4 and parts[3] == 'images':
+            return self._reply(200, {'id': int(parts[2]), 'posters': [{'file_path': f'/{parts[1]}{parts[2]}.jpg'}]})
+        if parts[0] == 'img':
+            return self._reply(200, self.server.poster, 'image/jpeg')
+        self._reply(404, {'success': False})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._fault():
+            return
+        method = self.path.rsplit('/', 1)[-1]
+        with self.server.lock:
+            self.server.sent += 1
+            message_id = self.server.sent
+        if method == 'sendPhoto':
+            return self._reply(200, {'ok': True, 'result': {
+                'message_id': message_id, 'photo': [{'file_id': f'f{message_id}'}]}})
+        if method == 'sendMediaGroup':
+            if 'urlencoded' in self.headers.get('Content-Type', ''):
+                body = unquote_plus(body.decode()).encode()
+            photos = body.count(b'"type": "photo"')
+            return self._reply(200, {'ok': True, 'result': [
+                {'message_id': message_id, 'photo': [{'file_id': f'f{message_id}.{i}'}]} for i in range(photos)]})
+        self._reply(404, {'ok': False, 'error_code': 404})
+
+
+def start_stand_ins(args):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.latency = args.latency_ms / 1000
+    server.error_rate = args.error_rate
+    server.throttle_rate = args.throttle_rate
+    server.poster = b'\xff\xd8' + os.urandom(args.poster_kb * 1024) + b'\xff\xd9'
+    server.lock = threading.Lock()
+    server.sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_redis():
+    """A throwaway redis-server; returns (port, process) or (None, None) when none is installed."""
+    if not shutil.which('redis-server'):
+        return None, None
+    port = free_port()
+    proc = subprocess.Popen(['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+                            stdout=subprocess.DEVNULL)
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return port, proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('redis-server did not start')
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def count_round_trips():
+    """Count the HTTP requests and Redis round trips made in this process from now on."""
+    import redis
+    import requests
+    counts = {'http': 0, 'redis': 0}
+    lock = threading.Lock()
+
+    def counting(kind, func):
+        def wrapper(*args, **kwargs):
+            with lock:
+                counts[kind] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    requests.adapters.HTTPAdapter.send = counting('http', requests.adapters.HTTPAdapter.send)
+    # Pipelines queue their commands and send them in execute().
+    redis.client.Redis.execute_command = counting('redis', redis.client.Redis.execute_command)
+    redis.client.Pipeline.execute = counting('redis', redis.client.Pipeline.execute)
+    return counts
+
+
+def per(counts, before, kind, items):
+    return round((counts[kind] - before[kind]) / items, 3) if items else 0.0
+
+
+def run_scenario(size, args):
+    """Runs inside the per-size subprocess; returns the result row."""
+    if not args.redis_port:
+        import redis
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis.Redis = redis.StrictRedis = lambda *a, **kw: fakeredis.FakeRedis(server=server)
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'tmdb'), os.path.join(ROOT, 'tg')]
+    import dev_tmdb
+    import dev_tg
+    from common.redis_batch import RedisBatch
+
+    dev_tmdb.HEADERS = {'accept': 'application/json'}
+    dev_tmdb.redis_client = dev_tmdb.get_redis_client()
+    dev_tmdb.redis_client.flushdb()
+    dev_tmdb.redis_batch = RedisBatch(dev_tmdb.redis_client)
+    dev_tmdb.http_session = dev_tmdb.get_http_session()
+    dev_tmdb.poster_cache = dev_tmdb.PosterCache(dev_tmdb.POSTERS_DIR, dev_tmdb.POSTER_CACHE_MAX_BYTES,
+                                                 dev_tmdb.POSTER_CACHE_MAX_FILES)
+    counts = count_round_trips()
+
+    job_times, snapshots = [], [dict(counts)]
+    for _ in range(1 + args.warm_cycles):
+        start = time.perf_counter()
+        dev_tmdb.main_job()
+        job_times.append(time.perf_counter() - start)
+        snapshots.append(dict(counts))
+    queued = dev_tg.r.zcard(dev_tg.PENDING_KEY)
+    warm_items = size * args.warm_cycles
+    before_publish = dict(counts)
+
+    cycle_times, published = [], 0
+    max_cycles = 10 * (size // dev_tg.PENDING_BATCH + 1)
+    while len(cycle_times) < max_cycles and (dev_tg.r.zcard(dev_tg.PENDING_KEY) or dev_tg.r.zcard(dev_tg.RETRY_KEY)):
+        start = time.perf_counter()
+        published += dev_tg.process_posters()
+        cycle_times.append(time.perf_counter() - start)
+    dev_tg.publisher_pool.shutdown()
+
+    publish_s = sum(cycle_times)
+    warm = job_times[1:] or job_times
+    return {
+        'size': size,
+        'queued': queued,
+        'published': published,
+        'dead': dev_tg.r.zcard(dev_tg.DEAD_KEY),
+        'ingest_s': round(job_times[0], 3),
+        'ingest_per_s': round(queued / job_times[0], 1) if job_times[0] else 0.0,
+        'job_p50_s': round(percentile(warm, 0.5), 4),
+        'job_p99_s': round(percentile(warm, 0.99), 4),
+        'publish_s': round(publish_s, 3),
+        'publish_per_s': round(published / publish_s, 1) if publish_s else 0.0,
+        'cycle_p50_s': round(percentile(cycle_times, 0.5), 4),
+        'cycle_p99_s': round(percentile(cycle_times, 0.99), 4),
+        'peak_rss_mb': peak_rss_mb(),
+        'ingest_http_per_favorite': per(snapshots[1], snapshots[0], 'http', size),
+        'ingest_redis_per_favorite': per(snapshots[1], snapshots[0], 'redis', size),
+        'warm_http_per_favorite': per(snapshots[-1], snapshots[1], 'http', warm_items),
+        'warm_redis_per_favorite': per(snapshots[-1], snapshots[1], 'redis', warm_items),
+        'publish_http_per_poster': per(counts, before_publish, 'http', published),
+        'publish_redis_per_poster': per(counts, before_publish, 'redis', published),
+    }
+
+
+def scenario_env(size, base_url, args):
+    return {
+        **os.environ,
+        'PYTHONPATH': ROOT,
+        'NO_PROXY': '127.0.0.1,localhost',
+        'LOG_LEVEL': args.log_level,
+        'REDIS_HOST': '127.0.0.1',
+        'REDIS_PORT': str(args.redis_port or 6379),
+        'TMDB_API_BASE': f'{base_url}/3',
+        'TMDB_ACCOUNT_ID': f'bench{size}',
+        'TMDB_RATE_LIMIT': '1000000',
+        'TMDB_RATE_BURST': '1000',
+        'TG_API_BASE': base_url,
+        'TG_CHAT_ID': '-1',
+        'TG_FILM_BOT_TOKEN': 'bench',
+        'TG_GLOBAL_RATE': '1000000',
+        'TG_CHAT_RATE_PER_MIN': '1000000000',
+        'TG_CHAT_BURST': '1000',
+        'TG_RETRY_BASE_DELAY': '0',
+    }
+
+
+def run_size(size, base_url, args):
+    """Run one size in a clean subprocess (fresh module state, its own RSS)."""
+    workdir = tempfile.mkdtemp(prefix=f'bench{size}-')
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-scenario', str(size),
+           '--warm-cycles', str(args.warm_cycles), '--redis-port', str(args.redis_port or 0)]
+    try:
+        out = subprocess.run(cmd, cwd=workdir, env=scenario_env(size, base_url, args), check=True,
+                             stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def regressions(rows, baseline, tolerance):
+    """Human-readable list of metrics that are worse than baseline by more than tolerance."""
+    failures = []
+    for row in rows:
+        base = baseline.get(str(row['size']))
+        if not base:
+            continue
+        if row['published'] < base['published']:
+            failures.append(f"size {row['size']}: published {row['published']} < {base['published']} baseline")
+        for metric in GATED_METRICS:
+            if row[metric] > base[metric] * (1 + tolerance):
+                failures.append(f"size {row['size']}: {metric} {row[metric]} > {base[metric]} baseline")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--warm-cycles', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every stand-in response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of stand-in responses that are 500s')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='share of stand-in responses that are 429s')
+    parser.add_argument('--poster-kb', type=int, default=40)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--check', metavar='BASELINE', help='exit 1 if worse than this baseline')
+    parser.add_argument('--write-baseline', metavar='BASELINE')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--verbose', action='store_true', help='show the services\' logs')
+    parser.add_argument('--run-scenario', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--redis-port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, args)))
+        return 0
+
+    stand_ins = start_stand_ins(args)
+    base_url = f'http://127.0.0.1:{stand_ins.server_port}'
+    args.redis_port, redis_proc = start_redis()
+    print(f"redis: {'redis-server' if redis_proc else 'fakeredis'}; latency {args.latency_ms} ms, "
+          f"errors {args.error_rate:.0%}, 429s {args.throttle_rate:.0%}")
+    rows = []
+    try:
+        for size in args.sizes:
+            row = run_size(size, base_url, args)
+            rows.append(row)
+            print(f"{size:>6} favorites: ingest {row['ingest_per_s']:>8}/s (cold {row['ingest_s']}s), "
+                  f"job p50/p99 {row['job_p50_s']}/{row['job_p99_s']}s, "
+                  f"publish {row['publish_per_s']:>8}/s, cycle p50/p99 {row['cycle_p50_s']}/{row['cycle_p99_s']}s, "
+                  f"published {row['published']}/{row['queued']}, peak RSS {row['peak_rss_mb']} MB")
+            print(f"{'':>6} round trips: ingest {row['ingest_http_per_favorite']} HTTP + "
+                  f"{row['ingest_redis_per_favorite']} Redis per favorite, warm {row['warm_http_per_favorite']} + "
+                  f"{row['warm_redis_per_favorite']} per favorite and cycle, publish "
+                  f"{row['publish_http_per_poster']} + {row['publish_redis_per_poster']} per poster")
+    finally:
+        stand_ins.shutdown()
+        if redis_proc:
+            redis_proc.terminate()
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w') as f:
+            json.dump({str(row['size']): row for row in rows}, f, indent=2)
+            f.write('\n')
+    if args.check:
+        with open(args.check) as f:
+            failures = regressions(rows, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
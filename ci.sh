@@ -18,11 +18,19 @@ echo "Running tests..."
 docker run --rm \
   -v "$PWD:/app" \
   python:3.10-slim-buster \
-  bash -c "cd /app && pip install -r tmdb/requirements.txt pytest pytest-mock && cd tmdb && PYTHONPATH=${PYTHONPATH:-.} pytest test_dev_tmdb.py -v"
+  bash -c "cd /app && pip install -r tmdb/requirements.txt -r tg/requirements.txt 'fakeredis[lua]==2.39.0' pytest pytest-mock && pytest tmdb tg common -v"
+
+# Offline end-to-end benchmark; fails the build when the services make more HTTP
+# requests or Redis round trips per item than recorded in bench/baseline.json
+echo "Running pipeline benchmark..."
+docker run --rm \
+  -v "$PWD:/app" \
+  python:3.10-slim-buster \
+  bash -c "cd /app && pip install -r tmdb/requirements.txt -r bench/requirements.txt && python bench/bench_pipeline.py --sizes 100 1000 --check bench/baseline.json"
 
 # Build Docker image
 echo "Building Docker image..."
-cd tmdb && docker build -f dockerfile_tmdb -t "$IMAGE_NAME:$NEW_TAG" . && cd ..
+docker build -f tmdb/dockerfile_tmdb -t "$IMAGE_NAME:$NEW_TAG" .
 
 # Tag and push to registry
 echo "Pushing to registry..."
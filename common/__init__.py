@@ -0,0 +1 @@
+# Code shared by the tmdb, tg and tun services
@@ -0,0 +1,81 @@
+import base64
+import struct
+import logging
+
+import redis
+
+from .schema import ARCHIVE_BUCKET, ARCHIVE_KEY, POSTER_KEY
+
+logger = logging.getLogger(__name__)
+
+# Largest packed value we expect; hashes whose values all fit stay listpack-encoded.
+LISTPACK_VALUE_BYTES = 128
+
+# vote_average * 1000, jpg length, file_id encoding (1: urlsafe base64 decoded, 0: raw).
+_HEADER = struct.Struct('>HHB')
+
+
+def archive_location(poster_id):
+    """(hash key, field) of a poster in the archive; legacy bare ids map to untyped buckets."""
+    media_type, _, number = str(poster_id).rpartition(':')
+    number = int(number)
+    bucket = number // ARCHIVE_BUCKET
+    return ARCHIVE_KEY.format(f"{media_type}:{bucket}" if media_type else bucket), number % ARCHIVE_BUCKET
+
+
+def pack(jpg, vote_average, file_id):
+    jpg = jpg.encode()
+    file_id = file_id or ''
+    raw = None
+    try:
+        raw = base64.urlsafe_b64decode(file_id + '=' * (-len(file_id) % 4))
+    except ValueError:
+        pass
+    # Only keep the decoded form when it re-encodes to exactly the same id.
+    if raw is None or base64.urlsafe_b64encode(raw).rstrip(b'=').decode() != file_id:
+        raw, decoded = file_id.encode(), 0
+    else:
+        decoded = 1
+    vote = min(65535, max(0, round(float(vote_average or 0) * 1000)))
+    return _HEADER.pack(vote, len(jpg), decoded) + jpg + raw
+
+
+def unpack(value):
+    vote, jpg_len, decoded = _HEADER.unpack_from(value)
+    start = _HEADER.size
+    jpg = value[start:start + jpg_len].decode()
+    raw = value[start + jpg_len:]
+    file_id = base64.urlsafe_b64encode(raw).rstrip(b'=').decode() if decoded else raw.decode()
+    return {'jpg': jpg, 'vote_average': f"{vote / 1000:g}", 'file_id': file_id or None}
+
+
+def queue_archive(pipe, poster_id, jpg, vote_average, file_id):
+    """Queue moving a published poster from its poster:{id} hash into the archive."""
+    key, field = archive_location(poster_id)
+    pipe.hset(key, field, pack(jpg, vote_average, file_id))
+    pipe.delete(POSTER_KEY.format(poster_id))
+
+
+def get_archived(client, poster_id):
+    """The archived record of a published poster, or None."""
+    value = client.hget(*archive_location(poster_id))
+    return unpack(value) if value is not None else None
+
+
+def exists_many(batch, poster_ids):
+    """Whether each poster id has a poster:{id} hash or an archived record (one script call on a RedisBatch)."""
+    return batch.exists_or_archived([POSTER_KEY.format(poster_id) for poster_id in poster_ids],
+                                    [archive_location(poster_id) for poster_id in poster_ids])
+
+
+def configure_compact_encoding(client):
+    """Make sure archive buckets can stay listpack-encoded; best effort (CONFIG may be disabled)."""
+    try:
+        config = client.config_get('hash-max-listpack-*')
+        if int(config.get('hash-max-listpack-value', 0)) < LISTPACK_VALUE_BYTES:
+            client.config_set('hash-max-listpack-value', LISTPACK_VALUE_BYTES)
+        if int(config.get('hash-max-listpack-entries', 0)) < ARCHIVE_BUCKET:
+            client.config_set('hash-max-listpack-entries', ARCHIVE_BUCKET)
+    except redis.RedisError as e:
+        logger.warning('Could not configure listpack limits; archive buckets may use more memory',
+                       extra={'component': 'redis', 'error': str(e)})
@@ -0,0 +1,75 @@
+import os
+import uuid
+import socket
+import logging
+
+from .schema import LEASE_KEY
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process as the holder of leases and claims.
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Deletes each of KEYS whose value is still ARGV[1]; returns how many.
+RELEASE_LUA = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        released = released + redis.call('DEL', key)
+    end
+end
+return released
+"""
+
+# Extends KEYS[1] to ARGV[2] ms if ARGV[1] still holds it; returns 1 if so.
+RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class Lease:
+    """A named lease held by one replica at a time (SET NX PX).
+
+    Only the holder can renew or release it; if the holder dies the lease
+    expires after ttl seconds and another replica can take over.
+    """
+
+    def __init__(self, client, name, ttl, owner=REPLICA_ID):
+        self.client = client
+        self.key = LEASE_KEY.format(name)
+        self.ttl_ms = int(ttl * 1000)
+        self.owner = owner
+        self._release = client.register_script(RELEASE_LUA)
+        self._renew = client.register_script(RENEW_LUA)
+
+    def acquire(self):
+        """Take the lease, or extend it if this replica already holds it; returns whether it is held."""
+        if self.client.set(self.key, self.owner, nx=True, px=self.ttl_ms):
+            return True
+        return self.renew()
+
+    def renew(self):
+        return bool(self._renew(keys=[self.key], args=[self.owner, self.ttl_ms]))
+
+    def release(self):
+        return bool(self._release(keys=[self.key], args=[self.owner]))
+
+
+def claim_many(client, keys, ttl, owner=REPLICA_ID):
+    """Claim every free key for ttl seconds in one round trip; returns the keys now held by owner."""
+    if not keys:
+        return []
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.set(key, owner, nx=True, px=int(ttl * 1000))
+    return [key for key, claimed in zip(keys, pipe.execute()) if claimed]
+
+
+def release_many(client, keys, owner=REPLICA_ID):
+    """Drop the claims on keys that owner still holds; returns how many were released."""
+    if not keys:
+        return 0
+    return client.register_script(RELEASE_LUA)(keys=list(keys), args=[owner])
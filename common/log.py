@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import socket
+import threading
+import uuid
+import logging
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_sampler = None
+
+
+def _dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class CustomJsonFormatter(logging.Formatter):
+    """One JSON object per record with service, pod and trace metadata.
+
+    Source location is only added to WARNING and above, and the traceback
+    only when the record carries exc_info.
+    """
+
+    def __init__(self, service_name):
+        super().__init__()
+        self.hostname = socket.gethostname()
+        self.base = {
+            'service': os.getenv('SERVICE_NAME', service_name),
+            'hostname': self.hostname,
+            'pod': os.getenv('POD_NAME', self.hostname),
+            'namespace': os.getenv('POD_NAMESPACE', 'default'),
+            'version': os.getenv('APP_VERSION', '1.0.0'),
+        }
+
+    def format(self, record):
+        log_record = {
+            'timestamp': record.created,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+            **self.base,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                log_record[key] = value
+        if record.levelno >= logging.WARNING or record.exc_info:
+            log_record.update(file=record.pathname, line=record.lineno, function=record.funcName)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            log_record['exception'] = record.exc_text
+        return _dumps(log_record)
+
+
+class RequestContextFilter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.trace_id = str(uuid.uuid4())
+
+    def filter(self, record):
+        record.trace_id = getattr(record, 'trace_id', self.trace_id)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Caps per-item chatter so log volume does not grow with the catalog.
+
+    WARNING and above always pass. DEBUG records are head-sampled at
+    debug_rate, then every message key (the `log_key` extra, or the
+    unformatted message) may pass `quota` records per `window` seconds.
+    Suppressed records are counted and reported as one summary record per
+    key when the window closes.
+    """
+
+    def __init__(self, quota, window, debug_rate=1.0):
+        super().__init__()
+        self.quota = quota
+        self.window = window
+        self.debug_rate = debug_rate
+        self.window_end = time.monotonic() + window
+        self.passed = Counter()
+        self.suppressed = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'log_summary', False):
+            return True
+        key = getattr(record, 'log_key', None) or str(record.msg)
+        sampled_out = record.levelno <= logging.DEBUG and random.random() >= self.debug_rate
+        with self._lock:
+            summaries = self._roll() if time.monotonic() >= self.window_end else None
+            allowed = not sampled_out and self.passed[key] < self.quota
+            if allowed:
+                self.passed[key] += 1
+            else:
+                self.suppressed[key] += 1
+        if summaries:
+            self._report(summaries)
+        return allowed
+
+    def _roll(self):
+        summaries = dict(self.suppressed)
+        self.passed.clear()
+        self.suppressed.clear()
+        self.window_end = time.monotonic() + self.window
+        return summaries
+
+    def _report(self, summaries):
+        for key, count in summaries.items():
+            logging.getLogger(__name__).info(
+                'Suppressed %d %r records', count, key,
+                extra={'log_summary': True, 'log_key': key, 'suppressed': count, 'window_s': self.window})
+
+    def flush(self):
+        with self._lock:
+            summaries = self._roll()
+        self._report(summaries)
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """Enqueue records without formatting them on the caller's thread.
+
+    The queue never leaves the process, so exc_info can travel as is; only
+    the message args are merged now because they may be mutated later.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(service_name, quiet=('requests', 'urllib3')):
+    """Route all records through a queue to a background JSON writer.
+
+    Logging calls only enqueue; formatting and the stream write happen on
+    the listener thread. High-volume INFO/DEBUG messages are capped by
+    SamplingFilter (LOG_SAMPLE_QUOTA records per key per LOG_SAMPLE_WINDOW
+    seconds, 0 disables; LOG_DEBUG_SAMPLE_RATE keeps that share of DEBUG).
+    Safe to call again: the previous listener is flushed and replaced.
+    """
+    global _listener, _sampler
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level, logging.INFO))
+    _flush()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+
+    console = logging.StreamHandler()
+    console.setFormatter(CustomJsonFormatter(service_name))
+    records = queue.SimpleQueue()
+    handler = _InProcessQueueHandler(records)
+    handler.addFilter(RequestContextFilter())
+    quota = int(os.getenv('LOG_SAMPLE_QUOTA', 50))
+    if quota > 0:
+        _sampler = SamplingFilter(quota, float(os.getenv('LOG_SAMPLE_WINDOW', 60)),
+                                  float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0)))
+        handler.addFilter(_sampler)
+    root.addHandler(handler)
+    _listener = QueueListener(records, console, respect_handler_level=True)
+    _listener.start()
+
+    for name in quiet:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    return root
+
+
+@atexit.register
+def _flush():
+    global _listener, _sampler
+    if _sampler is not None:
+        _sampler.flush()
+        _sampler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
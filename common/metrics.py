@@ -0,0 +1,215 @@
+import time
+import bisect
+import logging
+import weakref
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Registry:
+    """Named metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _value(v):
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Sharded:
+    """Per-thread shards: the hot path only touches its own thread's dict.
+
+    A lock is taken once per thread, when its shard is created; scrapes copy
+    every shard and merge them. When a thread goes away its shard is folded
+    into a base dict, so short-lived worker threads do not pile up shards.
+    """
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._base = {}
+        self._shards = {}
+        self._retired = deque()
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._collect()
+                self._shards[id(shard)] = shard
+            # Runs wherever the thread object is freed (maybe in the middle
+            # of a scrape on this very thread), so it only queues the shard.
+            weakref.finalize(threading.current_thread(), self._retired.append, shard)
+            return shard
+
+    def _collect(self):
+        """Fold the shards of finished threads into the base; caller holds the lock."""
+        while self._retired:
+            shard = self._retired.popleft()
+            del self._shards[id(shard)]
+            self._fold(self._base, shard)
+
+    def _fold(self, into, shard):
+        for key, value in shard.copy().items():
+            into[key] = self._combine(into[key], value) if key in into else value
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _merged(self):
+        with self._lock:
+            self._collect()
+            merged = dict(self._base)
+            shards = list(self._shards.values())
+        for shard in shards:
+            self._fold(merged, shard)
+        return merged
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    @staticmethod
+    def _combine(a, b):
+        return a + b
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._merged().get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self._merged().items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_value(value)}"
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        # Per-bucket (non-cumulative) counts, then the sum; the count is their total.
+        slots = shard.get(key)
+        if slots is None:
+            slots = shard[key] = [0] * (len(self.buckets) + 2)
+        slots[bisect.bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _combine(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def count(self, **labels):
+        slots = self._merged().get(self._key(labels))
+        return sum(slots[:-1]) if slots else 0
+
+    def samples(self):
+        for key, slots in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, '+Inf'), slots):
+                cumulative += n
+                le = bound if bound == '+Inf' else _value(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_value(slots[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Gauge:
+    """Last value wins; set is a single dict store, so no sharding is needed."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def set(self, value, **labels):
+        self._values[tuple(str(labels[name]) for name in self.labelnames)] = value
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+
+    def samples(self):
+        for key, value in sorted(self._values.copy().items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_value(value)}"
+
+
+def start_metrics_server(port, registry=REGISTRY):
+    """Serve GET /metrics on a daemon thread; port 0 disables it. Returns the server."""
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info('Metrics server started', extra={'component': 'metrics', 'port': port})
+    return server
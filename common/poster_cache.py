@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+
+from . import metrics
+from .schema import DEAD_KEY, INFLIGHT_KEY, PENDING_KEY, RETRY_KEY
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILES = metrics.Gauge('poster_cache_files', 'Files in the shared poster directory after the last sweep.')
+CACHE_BYTES = metrics.Gauge('poster_cache_bytes', 'Bytes in the shared poster directory after the last sweep.')
+CACHE_REMOVED = metrics.Counter('poster_cache_removed_total', 'Poster files removed from the shared directory.',
+                                ['reason'])
+
+# Posters whose record still waits somewhere in these sets have not been
+# published yet, so their files must stay.
+UNPUBLISHED_INDEXES = (PENDING_KEY, RETRY_KEY, INFLIGHT_KEY, DEAD_KEY)
+
+
+def pinned_files(client):
+    """Filenames of every poster that is not published yet (pending, retrying, claimed or dead)."""
+    pipe = client.pipeline(transaction=False)
+    for index in UNPUBLISHED_INDEXES:
+        pipe.zrange(index, 0, -1)
+    keys = list({key for members in pipe.execute() for key in members})
+    pinned = set()
+    for i in range(0, len(keys), 1000):
+        pipe = client.pipeline(transaction=False)
+        for key in keys[i:i + 1000]:
+            pipe.hget(key, 'jpg')
+        pinned.update(jpg.decode() for jpg in pipe.execute() if jpg)
+    return pinned
+
+
+class PosterCache:
+    """The poster directory shared by the tmdb and Telegram services, kept under a size cap.
+
+    Recency is the file's mtime: writes set it and touch() refreshes it on a
+    reuse, so enforce() evicts the least recently used files first and works
+    the same from any replica. Pinned files (posters not published yet) are
+    never evicted. max_bytes / max_files of 0 mean no limit.
+    """
+
+    def __init__(self, directory, max_bytes=0, max_files=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            pass
+
+    def discard(self, names, reason='published'):
+        """Remove the named files; missing ones are ignored. Returns how many were removed."""
+        removed = 0
+        for name in names:
+            try:
+                os.remove(self.path(name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        CACHE_REMOVED.inc(removed, reason=reason)
+        return removed
+
+    def _entries(self):
+        """(mtime, size, name) of every stored poster, skipping in-progress downloads."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.part') or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.name))
+        return entries
+
+    def _record(self, entries):
+        CACHE_FILES.set(len(entries))
+        CACHE_BYTES.set(sum(size for _, size, _ in entries))
+
+    def over_limit(self, files, size):
+        return bool((self.max_files and files > self.max_files) or (self.max_bytes and size > self.max_bytes))
+
+    def enforce(self, pinned=frozenset):
+        """Evict least recently used files until the directory is within its caps.
+
+        pinned is called only when something has to go, and returns the
+        names that must stay. Returns how many files were evicted.
+        """
+        entries = self._entries()
+        files, size = len(entries), sum(size for _, size, _ in entries)
+        if not self.over_limit(files, size):
+            self._record(entries)
+            return 0
+        keep = pinned()
+        evicted = 0
+        entries.sort()
+        for mtime, file_size, name in entries:
+            if not self.over_limit(files, size):
+                break
+            if name in keep:
+                continue
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            files, size = files - 1, size - file_size
+            evicted += 1
+        CACHE_REMOVED.inc(evicted, reason='evicted')
+        CACHE_FILES.set(files)
+        CACHE_BYTES.set(size)
+        extra = {'component': 'poster_cache', 'evicted': evicted, 'files': files, 'bytes': size}
+        if self.over_limit(files, size):
+            logger.warning('Poster cache over its cap with pinned files only', extra=extra)
+        else:
+            logger.info('Poster cache evicted', extra=extra)
+        return evicted
+
+    def reconcile(self, keep, grace=600):
+        """Delete files no unpublished poster references, and abandoned partial downloads.
+
+        Files younger than grace seconds are left alone: a replica may have
+        just stored them and not yet recorded the poster. Returns how many
+        files were removed.
+        """
+        cutoff = time.time() - grace
+        removed, remaining = 0, []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if not entry.is_file() or st.st_mtime > cutoff or entry.name in keep:
+                    if not entry.name.endswith('.part'):
+                        remaining.append((st.st_mtime, st.st_size, entry.name))
+                    continue
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        CACHE_REMOVED.inc(removed, reason='orphaned')
+        self._record(remaining)
+        logger.info('Poster cache reconciled', extra={
+            'component': 'poster_cache', 'removed': removed, 'files': len(remaining)})
+        return removed
@@ -0,0 +1,49 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """Thread-safe token bucket usable from threads and from asyncio.
+
+    reserve() books a token immediately and returns how long the caller must
+    wait before using it, so the lock is never held while sleeping.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        if (delay := self.reserve(tokens)) > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=1):
+        if (delay := self.reserve(tokens)) > 0:
+            await asyncio.sleep(delay)
+
+    def wait_time(self):
+        """Seconds until the next token is free, without booking it."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Grant nothing for the next `seconds`, e.g. after a server-side retry_after."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
@@ -0,0 +1,258 @@
+import time
+import logging
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SECONDS = Histogram('redis_batch_seconds', 'Latency of one pipelined Redis round trip.', ['operation'])
+
+# Inserts each hash only if its key does not exist yet, all in one round trip.
+# ARGV[1] is 1 when KEYS[1] names a sorted set that indexes inserted keys (0
+# for none) and ARGV[2] is their score. ARGV[3] is 2 when every hash key in
+# the remaining KEYS is followed by an archive hash (1 otherwise): a record
+# whose field is set there is skipped even though its hash is gone. Then, per
+# record, its archive field ('' without one), the number of field/value
+# arguments and them.
+INSERT_IF_ABSENT_LUA = """
+local indexed, score, stride = ARGV[1] == '1', ARGV[2], tonumber(ARGV[3])
+local index = indexed and KEYS[1]
+local inserted = {}
+local pos = 4
+for i = indexed and 2 or 1, #KEYS, stride do
+    local key, field, n = KEYS[i], ARGV[pos], tonumber(ARGV[pos + 1])
+    local archived = stride == 2 and redis.call('HEXISTS', KEYS[i + 1], field) == 1
+    if not archived and redis.call('EXISTS', key) == 0 then
+        redis.call('HSET', key, unpack(ARGV, pos + 2, pos + n + 1))
+        if indexed then
+            redis.call('ZADD', index, score, key)
+        end
+        table.insert(inserted, key)
+    end
+    pos = pos + n + 2
+end
+return inserted
+"""
+
+# Moves up to ARGV[2] members scored <= ARGV[1] from sorted set KEYS[1] to
+# KEYS[2] (scored ARGV[1]) atomically; returns the moved members.
+MOVE_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZADD', KEYS[2], ARGV[1], member)
+end
+return due
+"""
+
+# Claims up to ARGV[3] of the lowest-scored members of sorted set KEYS[1]
+# by moving them to KEYS[2] scored ARGV[1] + ARGV[2] (the claim's expiry);
+# returns the claimed members. Concurrent callers never get the same member.
+CLAIM_LUA = """
+local claimed = redis.call('ZRANGE', KEYS[1], 0, ARGV[3] - 1)
+local expires = tonumber(ARGV[1]) + tonumber(ARGV[2])
+for _, member in ipairs(claimed) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZADD', KEYS[2], expires, member)
+end
+return claimed
+"""
+
+# Moves members of sorted set KEYS[1] to KEYS[2] scored ARGV[1], resetting
+# hash field ARGV[2] of each member to 0. KEYS[3..] are the members (hash
+# keys); those not in KEYS[1] are skipped untouched. Returns the moved members.
+REQUEUE_LUA = """
+local moved = {}
+for i = 3, #KEYS do
+    local member = KEYS[i]
+    if redis.call('ZREM', KEYS[1], member) == 1 then
+        redis.call('HSET', member, ARGV[2], 0)
+        redis.call('ZADD', KEYS[2], ARGV[1], member)
+        table.insert(moved, member)
+    end
+end
+return moved
+"""
+
+# KEYS alternate a hash key and an archive hash, ARGV holds the archive field
+# of each pair; returns 1 per pair when the hash exists or the field is set
+# in the archive hash, else 0.
+EXISTS_OR_ARCHIVED_LUA = """
+local found = {}
+for i = 1, #ARGV do
+    local key, archive = KEYS[2 * i - 1], KEYS[2 * i]
+    found[i] = (redis.call('EXISTS', key) == 1 or redis.call('HEXISTS', archive, ARGV[i]) == 1) and 1 or 0
+end
+return found
+"""
+
+# Re-keys records stored under an old id. KEYS[1] is the in-flight set and
+# KEYS[2..1+n] (n = ARGV[1]) the other sorted-set indexes; then, per record,
+# 4 keys: old and new hash key, old and new archive hash, and 2 arguments:
+# the new id and the archive field. A record is moved only while its old hash
+# or archived value still exists, so concurrent callers adopt it once. A
+# record claimed by a publisher (its old key is in flight) is left as is and
+# adopted on a later call. Returns the new ids adopted and the new ids
+# deferred that way.
+ADOPT_LEGACY_LUA = """
+local inflight, n = KEYS[1], tonumber(ARGV[1])
+local adopted, deferred = {}, {}
+local k = 2 + n
+for pos = 2, #ARGV, 2 do
+    local new, field = ARGV[pos], ARGV[pos + 1]
+    local old_key, new_key, old_archive, new_archive = KEYS[k], KEYS[k + 1], KEYS[k + 2], KEYS[k + 3]
+    k = k + 4
+    local stored = redis.call('EXISTS', old_key) == 1
+    local packed = redis.call('HGET', old_archive, field)
+    if stored and redis.call('ZSCORE', inflight, old_key) then
+        table.insert(deferred, new)
+    elseif stored or packed then
+        if stored then
+            redis.call('RENAME', old_key, new_key)
+        end
+        for i = 2, 1 + n do
+            local score = redis.call('ZSCORE', KEYS[i], old_key)
+            if score then
+                redis.call('ZREM', KEYS[i], old_key)
+                redis.call('ZADD', KEYS[i], score, new_key)
+            end
+        end
+        if packed then
+            redis.call('HDEL', old_archive, field)
+            redis.call('HSET', new_archive, field, packed)
+        end
+        table.insert(adopted, new)
+    end
+end
+return {adopted, deferred}
+"""
+
+
+class RedisBatch:
+    """Pipelined Redis access: each call is one timed round trip, whatever the batch size."""
+
+    def __init__(self, client, component='redis'):
+        self.client = client
+        self.component = component
+        self._insert_if_absent = client.register_script(INSERT_IF_ABSENT_LUA)
+        self._move_due = client.register_script(MOVE_DUE_LUA)
+        self._claim = client.register_script(CLAIM_LUA)
+        self._adopt_legacy = client.register_script(ADOPT_LEGACY_LUA)
+        self._exists_or_archived = client.register_script(EXISTS_OR_ARCHIVED_LUA)
+        self._requeue = client.register_script(REQUEUE_LUA)
+
+    def pipeline(self):
+        return self.client.pipeline(transaction=True)
+
+    def _report(self, operation, size, start):
+        elapsed = time.perf_counter() - start
+        BATCH_SECONDS.observe(elapsed, operation=operation)
+        logger.info('Redis batch', extra={
+            'component': self.component, 'operation': operation, 'batch_size': size,
+            'latency_ms': round(elapsed * 1000, 2)})
+
+    def execute(self, pipe, operation, size):
+        start = time.perf_counter()
+        results = pipe.execute()
+        self._report(operation, size, start)
+        return results
+
+    def queue_insert_if_absent(self, pipe, records, index=None, score=0, archive=None):
+        """Queue an insert-if-absent of {key: mapping} records on pipe.
+
+        Inserted keys are also added to the sorted set index, if given, with
+        score. archive lists each record's (archive hash, field) in order;
+        records already archived there are skipped as well.
+        """
+        keys, args = [index] if index else [], [1 if index else 0, score, 2 if archive else 1]
+        for i, (key, mapping) in enumerate(records.items()):
+            keys.append(key)
+            field = ''
+            if archive:
+                bucket, field = archive[i]
+                keys.append(bucket)
+            args.extend((field, 2 * len(mapping)))
+            for name, value in mapping.items():
+                args.extend((name, value))
+        self._insert_if_absent(keys=keys, args=args, client=pipe)
+
+    def insert_if_absent(self, records, index=None, score=0, archive=None):
+        """Create the hashes whose keys are missing; returns the inserted keys."""
+        if not records:
+            return []
+        pipe = self.pipeline()
+        self.queue_insert_if_absent(pipe, records, index, score, archive)
+        return self.execute(pipe, 'insert_if_absent', len(records))[0]
+
+    def hgetall_many(self, keys):
+        if not keys:
+            return []
+        pipe = self.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        return self.execute(pipe, 'hgetall', len(keys))
+
+    def hset_many(self, updates):
+        """Apply {key: mapping} field updates in one round trip."""
+        if not updates:
+            return []
+        pipe = self.pipeline()
+        for key, mapping in updates.items():
+            pipe.hset(key, mapping=mapping)
+        return self.execute(pipe, 'hset', len(updates))
+
+    def move_due(self, source, target, now, limit=1000):
+        """Move members of sorted set source whose score is due (<= now) into target."""
+        start = time.perf_counter()
+        moved = self._move_due(keys=[source, target], args=[now, limit])
+        self._report('move_due', len(moved), start)
+        return moved
+
+    def claim(self, source, target, now, ttl, limit):
+        """Move the oldest `limit` members of source into target, claimed until now + ttl."""
+        start = time.perf_counter()
+        claimed = self._claim(keys=[source, target], args=[now, ttl, limit])
+        self._report('claim', len(claimed), start)
+        return claimed
+
+    def requeue(self, source, target, now, reset_field, members=()):
+        """Atomically move members (all if none given) from source to target, resetting reset_field.
+
+        Without members, source is read first so the script is handed every
+        key it writes; members added in between stay for the next call.
+        """
+        start = time.perf_counter()
+        if not members:
+            members = self.client.zrange(source, 0, -1)
+        moved = self._requeue(keys=[source, target, *members], args=[now, reset_field])
+        self._report('requeue', len(moved), start)
+        return moved
+
+    def exists_or_archived(self, keys, archive):
+        """For each hash key, whether it exists or its (archive hash, field) in archive is set."""
+        if not keys:
+            return []
+        start = time.perf_counter()
+        script_keys = []
+        for key, (bucket, _) in zip(keys, archive):
+            script_keys.extend((key, bucket))
+        found = self._exists_or_archived(keys=script_keys, args=[field for _, field in archive])
+        self._report('exists_or_archived', len(keys), start)
+        return [bool(flag) for flag in found]
+
+    def adopt_legacy(self, inflight, indexes, records):
+        """Atomically re-key records; returns the new ids (adopted, deferred because in flight).
+
+        Each record is (new id, old key, new key, old archive hash, new
+        archive hash, archive field); see ADOPT_LEGACY_LUA.
+        """
+        if not records:
+            return [], []
+        start = time.perf_counter()
+        keys, args = [inflight, *indexes], [len(indexes)]
+        for new, old_key, new_key, old_archive, new_archive, field in records:
+            keys.extend((old_key, new_key, old_archive, new_archive))
+            args.extend((new, field))
+        adopted, deferred = self._adopt_legacy(keys=keys, args=args)
+        self._report('adopt_legacy', len(records), start)
+        return adopted, deferred
@@ -0,0 +1,120 @@
+import time
+import random
+import logging
+import threading
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_SECONDS = metrics.Histogram('scheduler_job_seconds', 'Run time of each scheduled job.', ['job'])
+JOB_INTERVAL = metrics.Gauge('scheduler_interval_seconds', 'Current interval of each scheduled job.', ['job'])
+
+
+class AdaptiveInterval:
+    """An interval that shrinks while there is work and backs off while idle.
+
+    update() halves it after a run that found work (activity > 0) and grows
+    it by half after an idle one (activity == 0), within [minimum, maximum];
+    None (e.g. a failed run) leaves it unchanged. next() adds +/- jitter.
+    """
+
+    def __init__(self, base, minimum=None, maximum=None, jitter=0.1):
+        self.minimum = base if minimum is None else minimum
+        self.maximum = base if maximum is None else maximum
+        self.jitter = jitter
+        self.current = min(max(base, self.minimum), self.maximum)
+
+    def update(self, activity):
+        if activity is None:
+            return self.current
+        if activity:
+            self.current = max(self.minimum, self.current / 2)
+        else:
+            self.current = min(self.maximum, self.current * 1.5)
+        return self.current
+
+    def next(self):
+        return self.current * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class Job:
+    def __init__(self, name, func, interval, adaptive):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.adaptive = adaptive
+        self.next_run = 0.0
+        self.runs = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+
+
+class Scheduler:
+    """Runs jobs one at a time on the calling thread.
+
+    A job's next run is scheduled from the end of its previous one, so a
+    slow run delays the next instead of piling runs up back to back.
+    Adaptive jobs return how much work they found (see AdaptiveInterval).
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def every(self, seconds, func, name=None, minimum=None, maximum=None, jitter=0.1, run_now=False):
+        """Add func every `seconds`; with minimum/maximum its return value adapts the interval."""
+        adaptive = minimum is not None or maximum is not None
+        job = Job(name or func.__name__, func, AdaptiveInterval(seconds, minimum, maximum, jitter), adaptive)
+        job.next_run = time.monotonic() + (0 if run_now else job.interval.next())
+        JOB_INTERVAL.set(job.interval.current, job=job.name)
+        self.jobs.append(job)
+        return job
+
+    def run_job(self, job):
+        start = time.monotonic()
+        try:
+            result = job.func()
+        except Exception as e:
+            logger.error('Scheduled job failed', exc_info=True,
+                         extra={'component': 'scheduler', 'job': job.name, 'error': str(e)})
+            result = None
+        end = time.monotonic()
+        job.runs += 1
+        job.last_duration = end - start
+        job.total_duration += job.last_duration
+        JOB_SECONDS.observe(job.last_duration, job=job.name)
+        if job.adaptive:
+            job.interval.update(result)
+            JOB_INTERVAL.set(job.interval.current, job=job.name)
+        if job.last_duration > job.interval.current:
+            logger.warning('Scheduled job overran its interval', extra={
+                'component': 'scheduler', 'job': job.name, 'duration_s': round(job.last_duration, 3),
+                'interval_s': round(job.interval.current, 1)})
+        job.next_run = end + job.interval.next()
+        return result
+
+    def run_pending(self):
+        """Run every due job once; returns how many ran."""
+        due = [job for job in self.jobs if job.next_run <= time.monotonic()]
+        for job in sorted(due, key=lambda job: job.next_run):
+            self.run_job(job)
+        return len(due)
+
+    def stats(self):
+        """Per-job runs, last and average duration and current interval, in seconds."""
+        return {job.name: {'runs': job.runs, 'last_s': round(job.last_duration, 3),
+                           'avg_s': round(job.total_duration / job.runs, 3) if job.runs else 0.0,
+                           'interval_s': round(job.interval.current, 1)}
+                for job in self.jobs}
+
+    def idle_seconds(self):
+        if not self.jobs:
+            return None
+        return max(0.0, min(job.next_run for job in self.jobs) - time.monotonic())
+
+    def run_forever(self, stop=None):
+        """Sleep exactly until the next due job; returns once stop (a threading.Event) is set."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.run_pending()
+            stop.wait(self.idle_seconds())
@@ -0,0 +1,69 @@
+# Redis layout shared by the tmdb and tg services.
+#
+# Posters are identified by "{media_type}:{tmdb id}" (e.g. "movie:42",
+# "tv:42"): TMDB numbers movies and tv shows independently. Records
+# written before that used the bare id; tmdb re-keys them the first time it
+# sees the favorite again (RedisBatch.adopt_legacy).
+
+# Hash per poster id: jpg, url (in the image variant tmdb chose),
+# vote_average, status ('ready' until published), attempts (failed
+# publications so far) and, once Telegram has the photo, its file_id. A
+# poster id is known once it has this hash or an archived record
+# (common.archive.exists_many); nothing else is kept per poster.
+POSTER_KEY = 'poster:{}'
+
+# Set of known poster ids kept by earlier releases; tmdb deletes it on start.
+LEGACY_KNOWN_KEY = 'posters:known'
+
+# Sorted set of poster ids that have no poster on TMDB, scored by when to
+# look again; until then tmdb treats them like known ids.
+MISSING_KEY = 'posters:missing'
+
+# Sorted set of unpublished poster keys scored by ingest time; the Telegram
+# service only ever reads from here.
+PENDING_KEY = 'posters:pending'
+
+# List used as a wake-up signal: tmdb pushes after inserting new posters and
+# the Telegram service blocks on it with BLPOP. Trimmed to a single element.
+NOTIFY_KEY = 'posters:notify'
+
+# Sorted set of poster keys waiting to be retried, scored by the time of
+# their next attempt; due entries move back into PENDING_KEY.
+RETRY_KEY = 'posters:retry'
+
+# Sorted set of poster keys that exhausted their attempts, scored by the
+# time they gave up. Inspect and requeue with `python dev_tg.py dead-letters`
+# and `python dev_tg.py requeue-dead [poster_id ...]`.
+DEAD_KEY = 'posters:dead'
+
+# Hash of SOCKS tunnel port -> JSON health ({"healthy", "latency_ms",
+# "updated"}) written by the tunnel service after every probe; tmdb spreads
+# its requests over the healthy ones.
+TUNNELS_KEY = 'tunnels:health'
+
+# String refreshed with a PX expiry every time TUNNELS_KEY is written. Once
+# it expires the tunnel service has stopped reporting and every tunnel
+# counts as down; Redis judges the age, so clock skew between nodes does
+# not matter.
+TUNNELS_FRESH_KEY = 'tunnels:health:fresh'
+
+# Sorted set of poster keys a Telegram replica has claimed from PENDING_KEY,
+# scored by when the claim expires; expired claims (crashed replicas) are
+# moved back to PENDING_KEY by whichever replica sweeps next.
+INFLIGHT_KEY = 'posters:inflight'
+
+# String per poster id held by the tmdb replica that is resolving and
+# downloading it (value: replica id, with a TTL).
+CLAIM_KEY = 'claim:{}'
+
+# String per named lease (value: holder's replica id, with a TTL); see
+# common/leases.py.
+LEASE_KEY = 'lease:{}'
+
+# Published posters, packed (see common/archive.py) into hashes of up to
+# ARCHIVE_BUCKET entries: posters:archive:{media_type}:{id // ARCHIVE_BUCKET},
+# field id % ARCHIVE_BUCKET. Small hashes stay listpack-encoded, so an archived
+# poster costs about 40% of a poster:{id} hash when ids are dense; with
+# sparse ids most buckets hold a single poster and it is closer to 55%.
+ARCHIVE_KEY = 'posters:archive:{}'
+ARCHIVE_BUCKET = 100
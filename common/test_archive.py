@@ -0,0 +1,32 @@
+from unittest.mock import MagicMock
+
+from . import archive
+
+
+def test_pack_round_trips_and_stays_small():
+    file_id = 'AgACAgIAAxkDAAIBZ2Zl8Y3t_vJ-AAQIAA3kAAzUE'
+    value = archive.pack('kqjL17yufvn9OVLyXYpvtyrFfak.jpg', '7.25', file_id)
+    assert archive.unpack(value) == {'jpg': 'kqjL17yufvn9OVLyXYpvtyrFfak.jpg', 'vote_average': '7.25',
+                                     'file_id': file_id}
+    assert len(value) < archive.LISTPACK_VALUE_BYTES
+    # Ids that do not survive a base64 round trip are kept verbatim.
+    assert archive.unpack(archive.pack('a.jpg', 0, 'not*base64'))['file_id'] == 'not*base64'
+    assert archive.unpack(archive.pack('a.jpg', 0, None))['file_id'] is None
+
+
+def test_queue_archive_buckets_and_drops_the_hash():
+    pipe = MagicMock()
+    archive.queue_archive(pipe, 'tv:12345', 'a.jpg', '8.1', 'AAAA')
+    key, field, value = pipe.hset.call_args.args
+    assert (key, field) == ('posters:archive:tv:123', 45)
+    assert archive.unpack(value)['vote_average'] == '8.1'
+    pipe.delete.assert_called_once_with('poster:tv:12345')
+    assert archive.archive_location('12345') == ('posters:archive:123', 45)
+
+
+
+def test_exists_many_checks_hashes_and_the_archive():
+    batch = MagicMock()
+    archive.exists_many(batch, ['tv:12345', '7'])
+    batch.exists_or_archived.assert_called_once_with(['poster:tv:12345', 'poster:7'],
+                                                     [('posters:archive:tv:123', 45), ('posters:archive:0', 7)])
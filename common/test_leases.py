@@ -0,0 +1,31 @@
+from unittest.mock import MagicMock
+
+from . import leases
+
+
+def test_claim_many_keeps_only_the_keys_it_set():
+    client = MagicMock()
+    pipe = client.pipeline.return_value
+    pipe.execute.return_value = [True, None, True]
+    assert leases.claim_many(client, ['claim:1', 'claim:2', 'claim:3'], ttl=2, owner='me') == ['claim:1', 'claim:3']
+    pipe.set.assert_any_call('claim:2', 'me', nx=True, px=2000)
+    pipe.execute.assert_called_once()
+
+
+def test_lease_renews_when_already_held_and_fails_when_held_elsewhere():
+    client = MagicMock()
+    renew = MagicMock(return_value=1)
+    client.register_script.side_effect = lambda script: renew if script == leases.RENEW_LUA else MagicMock()
+    lease = leases.Lease(client, 'tg:backfill', ttl=30, owner='me')
+
+    client.set.return_value = True
+    assert lease.acquire()
+    client.set.assert_called_with('lease:tg:backfill', 'me', nx=True, px=30000)
+    renew.assert_not_called()
+
+    client.set.return_value = None
+    assert lease.acquire()
+    renew.assert_called_once_with(keys=['lease:tg:backfill'], args=['me', 30000])
+
+    renew.return_value = 0
+    assert not lease.acquire()
@@ -0,0 +1,66 @@
+import io
+import json
+import logging
+
+from . import log
+
+
+def _record(level, exc_info=None, **extra):
+    record = logging.LogRecord('svc', level, '/app/dev.py', 42, 'Poster %s', ('saved',), exc_info, func='job')
+    record.__dict__.update(extra)
+    return record
+
+
+def test_formatter_emits_extras_without_location_below_warning():
+    payload = json.loads(log.CustomJsonFormatter('tmdb-service').format(_record(logging.INFO, movie_id=7)))
+    assert payload['message'] == 'Poster saved'
+    assert payload['service'] == 'tmdb-service'
+    assert payload['movie_id'] == 7
+    assert 'file' not in payload and 'exception' not in payload
+
+
+def test_formatter_adds_location_and_traceback_when_present():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        import sys
+        record = _record(logging.ERROR, exc_info=sys.exc_info())
+    payload = json.loads(log.CustomJsonFormatter('tmdb-service').format(record))
+    assert payload['file'] == '/app/dev.py' and payload['line'] == 42
+    assert 'ValueError: boom' in payload['exception']
+
+
+def test_setup_logging_writes_through_the_queue():
+    root = log.setup_logging('tg-service')
+    stream = io.StringIO()
+    log._listener.handlers[0].setStream(stream)
+    try:
+        root.info('queued %d', 1, extra={'component': 'test'})
+        log._flush()
+        payload = json.loads(stream.getvalue())
+        assert payload['message'] == 'queued 1'
+        assert payload['component'] == 'test'
+        assert payload['trace_id']
+    finally:
+        log.setup_logging('tg-service')
+
+
+def test_sampling_filter_caps_each_key_and_reports_suppressed(mocker):
+    sampler = log.SamplingFilter(quota=2, window=60)
+    report = mocker.patch.object(sampler, '_report')
+    passed = [sampler.filter(_record(logging.INFO)) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert sampler.filter(_record(logging.INFO, log_key='other'))
+    assert sampler.filter(_record(logging.WARNING))
+
+    sampler.window_end = 0
+    assert sampler.filter(_record(logging.INFO))
+    report.assert_called_once_with({'Poster %s': 3})
+
+
+def test_sampling_filter_head_samples_debug(mocker):
+    sampler = log.SamplingFilter(quota=100, window=60, debug_rate=0.5)
+    mocker.patch('random.random', side_effect=[0.1, 0.9])
+    assert sampler.filter(_record(logging.DEBUG))
+    assert not sampler.filter(_record(logging.DEBUG))
+    assert sampler.suppressed == {'Poster %s': 1}
@@ -0,0 +1,61 @@
+import gc
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request
+
+from . import metrics
+
+
+def test_counter_merges_thread_shards():
+    registry = metrics.Registry()
+    counter = metrics.Counter('posters_total', 'Posters.', ['outcome'], registry=registry)
+    workers = [threading.Thread(target=lambda: [counter.inc(outcome='ok') for _ in range(1000)]) for _ in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    counter.inc(2, outcome='failed')
+    assert counter.value(outcome='ok') == 4000
+    assert 'posters_total{outcome="failed"} 2' in registry.render()
+
+
+def test_shards_of_finished_threads_are_folded():
+    registry = metrics.Registry()
+    hist = metrics.Histogram('job_seconds', 'Jobs.', ['outcome'], buckets=(1,), registry=registry)
+    for _ in range(5):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda _: hist.observe(0.5, outcome='ok'), range(40)))
+        del pool
+        gc.collect()
+    assert hist.count(outcome='ok') == 200
+    assert len(hist._shards) <= 4
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    hist = metrics.Histogram('req_seconds', 'Requests.', buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.5, 0.5, 3):
+        hist.observe(value)
+    lines = registry.render().splitlines()
+    assert 'req_seconds_bucket{le="0.1"} 1' in lines
+    assert 'req_seconds_bucket{le="1"} 3' in lines
+    assert 'req_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'req_seconds_sum 4.05' in lines
+    assert 'req_seconds_count 4' in lines
+
+
+def test_metrics_server_serves_registry():
+    registry = metrics.Registry()
+    metrics.Gauge('queue_depth', 'Depth.', ['queue'], registry=registry).set(7, queue='pending')
+    assert metrics.start_metrics_server(0, registry) is None
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = metrics.start_metrics_server(port, registry)
+    try:
+        body = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics').read().decode()
+        assert 'queue_depth{queue="pending"} 7' in body
+    finally:
+        server.shutdown()
+        server.server_close()
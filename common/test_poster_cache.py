@@ -0,0 +1,39 @@
+import os
+import time
+from unittest.mock import MagicMock
+
+from . import poster_cache
+
+
+def _write(directory, name, size, age):
+    path = directory / name
+    path.write_bytes(b'x' * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_enforce_evicts_least_recently_used_unpinned_files(tmp_path):
+    for i, name in enumerate(['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']):
+        _write(tmp_path, name, 100, age=100 - i)
+    cache = poster_cache.PosterCache(str(tmp_path), max_bytes=250, max_files=10)
+    cache.touch('b.jpg')
+
+    assert cache.enforce(lambda: {'a.jpg'}) == 2
+    assert sorted(os.listdir(tmp_path)) == ['a.jpg', 'b.jpg']
+
+    pinned = MagicMock()
+    assert cache.enforce(pinned) == 0
+    pinned.assert_not_called()
+
+
+def test_reconcile_keeps_pinned_and_recent_files(tmp_path):
+    _write(tmp_path, 'orphan.jpg', 10, age=3600)
+    _write(tmp_path, 'pending.jpg', 10, age=3600)
+    _write(tmp_path, 'fresh.jpg', 10, age=5)
+    _write(tmp_path, 'abc.jpg.1f2e.part', 10, age=3600)
+    client = MagicMock()
+    client.pipeline.return_value.execute.side_effect = [[[b'poster:1'], [], [], []], [b'pending.jpg']]
+
+    removed = poster_cache.PosterCache(str(tmp_path)).reconcile(poster_cache.pinned_files(client))
+    assert removed == 2
+    assert sorted(os.listdir(tmp_path)) == ['fresh.jpg', 'pending.jpg']
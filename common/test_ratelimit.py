@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+from .ratelimit import TokenBucket
+
+
+def test_reserve_spends_burst_then_spaces_requests():
+    with patch('common.ratelimit.time.monotonic', return_value=100.0):
+        bucket = TokenBucket(rate=2, burst=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0.5
+        assert bucket.reserve() == 1.0
+
+
+def test_refills_over_time_up_to_capacity():
+    with patch('common.ratelimit.time.monotonic', return_value=100.0):
+        bucket = TokenBucket(rate=1, burst=3)
+        for _ in range(3):
+            bucket.reserve()
+    with patch('common.ratelimit.time.monotonic', return_value=200.0):
+        assert bucket.reserve() == 0
+        assert bucket.tokens == 2
+
+
+def test_pause_delays_next_grant():
+    with patch('common.ratelimit.time.monotonic', return_value=100.0):
+        bucket = TokenBucket(rate=10, burst=10)
+        bucket.pause(5)
+        assert bucket.wait_time() == 5.1
+        assert bucket.reserve() == 5.1
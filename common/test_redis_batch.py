@@ -0,0 +1,130 @@
+from unittest.mock import MagicMock
+
+import fakeredis
+
+from .redis_batch import RedisBatch
+
+
+def test_insert_if_absent_flattens_records_for_the_script():
+    client = MagicMock()
+    pipe = client.pipeline.return_value
+    pipe.execute.return_value = [[b'poster:1']]
+    batch = RedisBatch(client)
+    script = client.register_script.return_value
+
+    inserted = batch.insert_if_absent({
+        'poster:1': {'jpg': 'a.jpg', 'status': 'ready'},
+        'poster:2': {'jpg': 'b.jpg'},
+    })
+    assert inserted == [b'poster:1']
+    script.assert_called_once_with(
+        keys=['poster:1', 'poster:2'],
+        args=[0, 0, 1, '', 4, 'jpg', 'a.jpg', 'status', 'ready', '', 2, 'jpg', 'b.jpg'],
+        client=pipe)
+    pipe.execute.assert_called_once()
+
+
+def test_hgetall_many_uses_one_pipeline():
+    client = MagicMock()
+    pipe = client.pipeline.return_value
+    pipe.execute.return_value = [{b'status': b'ready'}, {}]
+
+    assert RedisBatch(client).hgetall_many(['poster:1', 'poster:2']) == [{b'status': b'ready'}, {}]
+    assert pipe.hgetall.call_count == 2
+    pipe.execute.assert_called_once()
+
+
+def test_empty_batches_skip_redis():
+    client = MagicMock()
+    batch = RedisBatch(client)
+    assert batch.insert_if_absent({}) == []
+    assert batch.hgetall_many([]) == []
+    assert batch.hset_many({}) == []
+    client.pipeline.assert_not_called()
+
+
+def test_move_due_runs_script_with_cutoff():
+    client = MagicMock()
+    batch = RedisBatch(client)
+    move_due = client.register_script.return_value
+    move_due.return_value = [b'poster:1']
+
+    assert batch.move_due('posters:retry', 'posters:pending', 100.0, limit=50) == [b'poster:1']
+    move_due.assert_called_with(keys=['posters:retry', 'posters:pending'], args=[100.0, 50])
+
+
+def test_requeue_passes_members_to_the_script():
+    client = MagicMock()
+    batch = RedisBatch(client)
+    requeue = client.register_script.return_value
+    requeue.return_value = [b'poster:movie:1']
+
+    assert batch.requeue('posters:dead', 'posters:pending', 100.0, 'attempts',
+                         ['poster:movie:1', 'poster:movie:2']) == [b'poster:movie:1']
+    requeue.assert_called_with(keys=['posters:dead', 'posters:pending', 'poster:movie:1', 'poster:movie:2'],
+                               args=[100.0, 'attempts'])
+
+
+def test_requeue_without_members_moves_the_whole_set():
+    client = fakeredis.FakeRedis()
+    client.zadd('posters:dead', {'poster:movie:1': 1, 'poster:movie:2': 2})
+    client.hset('poster:movie:1', 'attempts', 5)
+
+    moved = RedisBatch(client).requeue('posters:dead', 'posters:pending', 100.0, 'attempts')
+    assert moved == [b'poster:movie:1', b'poster:movie:2']
+    assert client.zcard('posters:dead') == 0
+    assert client.zrange('posters:pending', 0, -1, withscores=True) == [(b'poster:movie:1', 100.0),
+                                                                        (b'poster:movie:2', 100.0)]
+    assert client.hget('poster:movie:1', 'attempts') == b'0'
+
+
+def test_insert_if_absent_skips_archived_records():
+    client = fakeredis.FakeRedis()
+    # movie:1 was published and archived: its hash is gone, its archived value stays.
+    client.hset('posters:archive:movie:0', 1, 'packed')
+    inserted = RedisBatch(client).insert_if_absent(
+        {'poster:movie:1': {'jpg': 'a.jpg'}, 'poster:movie:2': {'jpg': 'b.jpg'}},
+        index='posters:pending', score=5, archive=[('posters:archive:movie:0', 1), ('posters:archive:movie:0', 2)])
+    assert inserted == [b'poster:movie:2']
+    assert not client.exists('poster:movie:1')
+    assert client.zrange('posters:pending', 0, -1) == [b'poster:movie:2']
+
+
+def test_exists_or_archived_checks_the_hash_then_the_archive():
+    client = fakeredis.FakeRedis()
+    client.hset('poster:movie:1', 'jpg', 'a.jpg')
+    client.hset('posters:archive:movie:0', 2, 'packed')
+    found = RedisBatch(client).exists_or_archived(
+        ['poster:movie:1', 'poster:movie:2', 'poster:movie:3'],
+        [('posters:archive:movie:0', 1), ('posters:archive:movie:0', 2), ('posters:archive:movie:0', 3)])
+    assert found == [True, True, False]
+
+
+def _legacy(old, new):
+    return (new, f'poster:{old}', f'poster:{new}', 'posters:archive:1', 'posters:archive:movie:1', 23)
+
+
+def test_adopt_legacy_leaves_records_in_flight_for_a_later_call():
+    client = fakeredis.FakeRedis()
+    client.hset('poster:123', 'jpg', 'a.jpg')
+    client.hset('poster:124', 'jpg', 'b.jpg')
+    client.zadd('posters:inflight', {'poster:123': 10})
+    client.zadd('posters:pending', {'poster:124': 5})
+    batch = RedisBatch(client)
+    indexes = ('posters:pending', 'posters:retry', 'posters:dead')
+
+    adopted, deferred = batch.adopt_legacy('posters:inflight', indexes,
+                                           [_legacy('123', 'movie:123'), _legacy('124', 'movie:124')])
+    assert (adopted, deferred) == ([b'movie:124'], [b'movie:123'])
+    assert client.hgetall('poster:123') == {b'jpg': b'a.jpg'}
+    assert client.zrange('posters:pending', 0, -1) == [b'poster:movie:124']
+    # Adopted once: the old record is gone, so a second caller (a tv show with the same id) gets nothing.
+    assert batch.adopt_legacy('posters:inflight', indexes, [_legacy('124', 'tv:124')]) == ([], [])
+
+    # Published meanwhile: tg archived it under the old id.
+    client.zrem('posters:inflight', 'poster:123')
+    client.delete('poster:123')
+    client.hset('posters:archive:1', 23, 'packed')
+    assert batch.adopt_legacy('posters:inflight', indexes, [_legacy('123', 'movie:123')]) == ([b'movie:123'], [])
+    assert client.hget('posters:archive:movie:1', 23) == b'packed'
+    assert not client.exists('poster:movie:123')
@@ -0,0 +1,37 @@
+from . import scheduler
+
+
+def test_adaptive_interval_shrinks_with_work_and_backs_off_when_idle():
+    interval = scheduler.AdaptiveInterval(40, minimum=10, maximum=90, jitter=0)
+    assert interval.update(3) == 20
+    assert interval.update(1) == 10
+    assert interval.update(5) == 10
+    assert interval.update(None) == 10
+    for _ in range(10):
+        interval.update(0)
+    assert interval.current == 90
+    assert interval.next() == 90
+
+
+def test_next_run_counts_from_the_end_of_a_slow_run(mocker):
+    mocker.patch('time.monotonic', side_effect=[0, 0, 0, 100])
+    sched = scheduler.Scheduler()
+    runs = []
+    job = sched.every(40, lambda: runs.append(1) or 0, name='job', minimum=10, maximum=120, jitter=0, run_now=True)
+    assert sched.run_pending() == 1
+    assert runs == [1]
+    # Idle run: 40 * 1.5 from the end of the run, not from its start.
+    assert job.next_run == 160
+    assert sched.stats()['job'] == {'runs': 1, 'last_s': 100, 'avg_s': 100, 'interval_s': 60}
+
+
+def test_failed_jobs_are_logged_and_keep_their_interval():
+    sched = scheduler.Scheduler()
+
+    def boom():
+        raise RuntimeError('boom')
+
+    job = sched.every(40, boom, minimum=10, maximum=120, run_now=True)
+    assert sched.run_pending() == 1
+    assert job.runs == 1 and job.interval.current == 40
+    assert sched.run_pending() == 0
@@ -0,0 +1,42 @@
+import json
+from unittest.mock import MagicMock
+
+from . import tunnels
+from .schema import TUNNELS_FRESH_KEY, TUNNELS_KEY
+
+
+def _client(states, fresh=True):
+    client = MagicMock()
+    client.pipeline.return_value.execute.return_value = [{
+        port.encode(): json.dumps({'healthy': healthy, 'latency_ms': latency, 'updated': 0}).encode()
+        for port, (healthy, latency) in states.items()}, int(fresh)]
+    return client
+
+
+def test_publish_health_writes_all_tunnels_at_once():
+    client = MagicMock()
+    pipe = client.pipeline.return_value
+    tunnels.publish_health(client, {1089: (True, 120.5), 1090: (False, None)}, ttl=5)
+    pipe.hset.assert_called_once()
+    mapping = pipe.hset.call_args.kwargs['mapping']
+    assert pipe.hset.call_args.args == (TUNNELS_KEY,)
+    pipe.set.assert_called_once_with(TUNNELS_FRESH_KEY, 1, px=5000)
+    assert json.loads(mapping['1089'])['latency_ms'] == 120.5
+    assert json.loads(mapping['1090'])['healthy'] is False
+
+
+def test_pool_skips_unhealthy_stale_and_failed_tunnels():
+    assert tunnels.TunnelPool(_client({'1089': (True, 50)}, fresh=False), fallback=[1089]).healthy() == []
+    pool = tunnels.TunnelPool(_client({'1089': (True, 50), '1090': (False, None), '1092': (True, 80)}))
+    assert sorted(pool.healthy()) == ['1089', '1092']
+    pool.mark_down('1089')
+    assert {pool.choose() for _ in range(20)} == {'1092'}
+    pool.mark_down('1092')
+    assert pool.choose() is None
+
+
+def test_pool_prefers_fast_tunnels_and_falls_back_when_nothing_is_published():
+    pool = tunnels.TunnelPool(_client({'1089': (True, 10), '1090': (True, 1000)}))
+    picks = [pool.choose() for _ in range(500)]
+    assert picks.count('1089') > 400
+    assert tunnels.TunnelPool(_client({}), fallback=[1089]).choose() == '1089'
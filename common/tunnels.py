@@ -0,0 +1,95 @@
+import json
+import time
+import random
+import logging
+import threading
+
+import redis
+import requests
+
+from .schema import TUNNELS_FRESH_KEY, TUNNELS_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class TunnelsDown(requests.ConnectionError):
+    """Raised instead of sending a request while no tunnel is healthy."""
+
+
+def publish_health(client, states, ttl=5):
+    """Store {port: (healthy, latency_ms)} for every tunnel and mark it fresh for ttl seconds."""
+    pipe = client.pipeline()
+    pipe.hset(TUNNELS_KEY, mapping={
+        str(port): json.dumps({'healthy': healthy, 'latency_ms': latency_ms, 'updated': time.time()})
+        for port, (healthy, latency_ms) in states.items()})
+    pipe.set(TUNNELS_FRESH_KEY, 1, px=int(ttl * 1000))
+    pipe.execute()
+
+
+class TunnelPool:
+    """Latency-weighted choice among the healthy tunnels published in TUNNELS_KEY.
+
+    Health is re-read at most every refresh_interval seconds, so the pool
+    follows the tunnel service's once-a-second probes; once the freshness
+    key set by publish_health expires, every tunnel counts as down. A tunnel that fails a request is
+    skipped locally for cooldown seconds. If the tunnel service has
+    published nothing, the fallback ports are used with equal weight.
+
+    Because every caller shares the pool, it doubles as a circuit breaker:
+    with no healthy tunnel, choose() returns None at once and callers fail
+    fast instead of waiting out their timeouts.
+    """
+
+    def __init__(self, client, fallback=(), refresh_interval=1, cooldown=10):
+        self.client = client
+        self.fallback = tuple(str(port) for port in fallback)
+        self.refresh_interval = refresh_interval
+        self.cooldown = cooldown
+        self._tunnels = {port: 1.0 for port in self.fallback}
+        self._down = {}
+        self._refresh_at = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            pipe = self.client.pipeline()
+            pipe.hgetall(TUNNELS_KEY)
+            pipe.exists(TUNNELS_FRESH_KEY)
+            raw, fresh = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning('Tunnel health unavailable', extra={'component': 'tunnels', 'error': str(e)})
+            return
+        tunnels = {}
+        for port, value in raw.items() if fresh else ():
+            state = json.loads(value)
+            if state.get('healthy'):
+                tunnels[port.decode()] = 1 / max(float(state.get('latency_ms') or 1), 1)
+        self._tunnels = tunnels if raw else {port: 1.0 for port in self.fallback}
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if now < self._refresh_at:
+            return
+        with self._lock:
+            if now < self._refresh_at:
+                return
+            self._refresh_at = now + self.refresh_interval
+        self.refresh()
+
+    def healthy(self):
+        """Ports currently eligible for requests."""
+        self._maybe_refresh()
+        now = time.monotonic()
+        return [port for port in self._tunnels if self._down.get(port, 0) <= now]
+
+    def choose(self):
+        """A healthy port, favouring low latency; None when every tunnel is down."""
+        ports = self.healthy()
+        if not ports:
+            return None
+        tunnels = self._tunnels
+        return random.choices(ports, weights=[tunnels.get(port, 1.0) for port in ports])[0]
+
+    def mark_down(self, port):
+        self._down[port] = time.monotonic() + self.cooldown
+        logger.warning('Tunnel marked down', extra={'component': 'tunnels', 'port': port, 'cooldown_s': self.cooldown})
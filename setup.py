@@ -7,7 +7,7 @@ setup(
     install_requires=[
         "redis",
         "requests",
-        "python-json-logger",
+        "orjson",
         "python-dotenv"
     ],
 )
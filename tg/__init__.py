@@ -0,0 +1 @@
+# This file makes the tg directory a Python package
@@ -4,76 +4,39 @@ import requests
 import logging
 import time
 import json
-import socket
 import uuid
-import traceback
+import random
+import signal
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError
 from dotenv import load_dotenv
-import schedule
-from pythonjsonlogger import jsonlogger
+
+from common import metrics
+from common.archive import configure_compact_encoding, queue_archive
+from common.log import setup_logging
+from common.poster_cache import PosterCache
+from common.ratelimit import TokenBucket
+from common.redis_batch import RedisBatch
+from common.leases import Lease
+from common.scheduler import AdaptiveInterval
+from common.schema import DEAD_KEY, INFLIGHT_KEY, NOTIFY_KEY, PENDING_KEY, POSTER_KEY, RETRY_KEY
 # Load environment variables from .env file
 load_dotenv()
 
-class CustomJsonFormatter(jsonlogger.JsonFormatter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.hostname = socket.gethostname()
-        self.pod_name = os.getenv('POD_NAME', self.hostname)
-        self.namespace = os.getenv('POD_NAMESPACE', 'default')
-        self.service_name = os.getenv('SERVICE_NAME', 'telegram-service')
-        self.app_version = os.getenv('APP_VERSION', '1.0.0')
-
-    def add_fields(self, log_record, record, message_dict):
-        super().add_fields(log_record, record, message_dict)
-        log_record.update({
-            'timestamp': record.created,
-            'level': record.levelname,
-            'logger': record.name,
-            'service': self.service_name,
-            'hostname': self.hostname,
-            'pod': self.pod_name,
-            'namespace': self.namespace,
-            'version': self.app_version,
-            'file': record.pathname,
-            'line': record.lineno,
-            'function': record.funcName,
-        })
-        if record.exc_info:
-            log_record['exception'] = traceback.format_exception(*record.exc_info)
-        if trace_id := getattr(record, 'trace_id', None):
-            log_record['trace_id'] = trace_id
-
-class RequestContextFilter(logging.Filter):
-    def __init__(self):
-        super().__init__()
-        self.trace_id = str(uuid.uuid4())
-
-    def filter(self, record):
-        record.trace_id = getattr(record, 'trace_id', self.trace_id)
-        return True
-
-def setup_logging():
-    level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logger = logging.getLogger()
-    logger.setLevel(level)
-    
-    for h in logger.handlers[:]:
-        logger.removeHandler(h)
-    
-    handler = logging.StreamHandler()
-    formatter = CustomJsonFormatter('%(timestamp)s %(level)s [%(service)s] [%(trace_id)s] %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    
-    logger.addFilter(RequestContextFilter())
-    for name in ('requests', 'urllib3', 'schedule'):
-        logging.getLogger(name).setLevel(logging.WARNING)
-    
-    return logger
+# Fallback sweep of the pending set when no notification arrives. Sweeps
+# that publish something shorten the interval (down to the minimum), idle
+# ones stretch it (up to the maximum); notifications still wake at once.
+RECONCILE_INTERVAL = int(os.environ.get('TG_RECONCILE_INTERVAL', 60))
+reconcile = AdaptiveInterval(RECONCILE_INTERVAL,
+                             float(os.environ.get('TG_RECONCILE_MIN_INTERVAL', 10)),
+                             float(os.environ.get('TG_RECONCILE_MAX_INTERVAL', 300)))
 
 # Connect to Redis
-logger = setup_logging()
+logger = setup_logging('telegram-service')
 try:
-    r = redis.Redis(
+    redis_config = dict(
         host=os.environ.get('REDIS_HOST'),
         port=int(os.environ.get('REDIS_PORT')),
         db=int(os.environ.get('REDIS_DB', 0)),
@@ -81,7 +44,11 @@ try:
         socket_connect_timeout=5,
         retry_on_timeout=True
     )
+    r = redis.Redis(**redis_config)
     r.ping()
+    batch = RedisBatch(r)
+    # BLPOP keeps the connection idle for up to 5 seconds per call.
+    r_blocking = redis.Redis(**{**redis_config, 'socket_timeout': 15})
     logger.info("Redis connection established", 
                 extra={'component': 'redis', 'operation': 'connect'})
 except Exception as e:
@@ -98,46 +65,340 @@ if not TG_CHAT_ID or not TG_FILM_BOT_TOKEN:
     logging.error("Environment variables TG_CHAT_ID or TG_FILM_BOT_TOKEN are not set")
     exit(1)
 
-def publish_poster(movie_id, jpg, vote_average):
-    """Publish the poster image to Telegram."""
-    url = f"https://api.telegram.org/bot{TG_FILM_BOT_TOKEN}/sendPhoto"
-    payload = {
-        "chat_id": TG_CHAT_ID,
-        "caption": f"TMDB: {vote_average}",
-        "parse_mode": "HTML"
-    }
-    
-    extra = {
-        'component': 'telegram',
-        'movie_id': movie_id,
-        'file': jpg,
-        'operation': 'send_photo'
-    }
-    
-    try:
-        os.makedirs("jpgs", exist_ok=True)
-        with open(f"jpgs/{jpg}", "rb") as photo:
-            response = requests.post(url, data=payload, files={"photo": photo}, timeout=10)
-            
-        if response.status_code == 200:
+# Max pending posters handled per cycle, oldest first.
+PENDING_BATCH = int(os.environ.get('TG_PENDING_BATCH', 100))
+# Each cycle claims its batch by moving it from the pending set to the
+# in-flight set, so replicas never publish the same poster. A replica that
+# dies holding claims loses them after TG_CLAIM_TTL seconds.
+TG_CLAIM_TTL = float(os.environ.get('TG_CLAIM_TTL', 600))
+
+# Let Telegram fetch posters from image.tmdb.org instead of uploading the
+# bytes from the shared jpgs volume. The URL is the one tmdb recorded for the
+# variant it chose; TMDB_IMAGE_BASE only serves records stored before that.
+TG_SEND_BY_URL = os.environ.get('TG_SEND_BY_URL', '').lower() in ('1', 'true', 'yes')
+TMDB_IMAGE_BASE = os.environ.get('TMDB_IMAGE_BASE', 'https://image.tmdb.org/t/p/w500')
+# Files are deleted from the shared volume once their poster is published;
+# a poster whose file is gone (evicted by the tmdb service) is sent by URL.
+POSTERS_DIR = 'jpgs'
+poster_cache = PosterCache(POSTERS_DIR)
+# Overridable so the offline benchmark can point the sender at a local stand-in.
+TG_API_BASE = os.environ.get('TG_API_BASE', 'https://api.telegram.org').rstrip('/')
+
+# Telegram allows about 30 messages per second overall and 20 per minute into
+# one group or channel; an album of up to 10 photos is one send.
+TG_GLOBAL_RATE = float(os.environ.get('TG_GLOBAL_RATE', 30))
+TG_CHAT_RATE_PER_MIN = float(os.environ.get('TG_CHAT_RATE_PER_MIN', 20))
+TG_CHAT_BURST = int(os.environ.get('TG_CHAT_BURST', 5))
+TG_MEDIA_GROUP_SIZE = max(1, min(10, int(os.environ.get('TG_MEDIA_GROUP_SIZE', 10))))
+TG_SEND_ATTEMPTS = int(os.environ.get('TG_SEND_ATTEMPTS', 3))
+# Uploads get TG_UPLOAD_TIMEOUT_PER_PHOTO extra seconds per attached file on
+# top of TG_REQUEST_TIMEOUT: a 10-photo album can take a while to send.
+TG_REQUEST_TIMEOUT = float(os.environ.get('TG_REQUEST_TIMEOUT', 10))
+TG_UPLOAD_TIMEOUT_PER_PHOTO = float(os.environ.get('TG_UPLOAD_TIMEOUT_PER_PHOTO', 10))
+# Statuses that mean Telegram rejected something in the request itself, so
+# an album is worth splitting to find the poster at fault.
+TG_REJECTED_STATUSES = frozenset((400, 413))
+
+# Failed posters wait base * 2**(attempts-1) seconds (capped, with jitter)
+# in the retry set and are dead-lettered after TG_MAX_ATTEMPTS failures.
+TG_RETRY_BASE_DELAY = float(os.environ.get('TG_RETRY_BASE_DELAY', 30))
+TG_RETRY_MAX_DELAY = float(os.environ.get('TG_RETRY_MAX_DELAY', 3600))
+TG_MAX_ATTEMPTS = int(os.environ.get('TG_MAX_ATTEMPTS', 8))
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9102))
+PUBLISH_SECONDS = metrics.Histogram('tg_publish_seconds', 'Telegram API call latency by method and outcome.',
+                                    ['method', 'outcome'])
+CYCLE_SECONDS = metrics.Histogram('tg_process_seconds', 'Duration of one process_posters cycle.')
+QUEUE_DEPTH = metrics.Gauge('tg_queue_depth', 'Posters in the pending, in-flight, retry and dead-letter sets.',
+                            ['queue'])
+POSTERS_PUBLISHED = metrics.Counter('tg_posters_published_total', 'Posters published to the channel.')
+POSTERS_FAILED = metrics.Counter('tg_posters_failed_total', 'Failed poster publications by outcome.', ['outcome'])
+
+Poster = namedtuple('Poster', ['key', 'movie_id', 'jpg', 'url', 'vote_average', 'file_id', 'attempts'])
+
+# Outcome of a poster that only Telegram's rate limit kept from being sent.
+THROTTLED = object()
+
+
+def caption(poster):
+    return f"TMDB: {poster.vote_average}"
+
+
+class TelegramSender:
+    """Sends posters within Telegram's rate limits, batched into albums.
+
+    A 429 pauses the chat bucket for retry_after seconds and the same request
+    is retried, up to TG_SEND_ATTEMPTS times; after that its posters are
+    reported THROTTLED.
+    """
+
+    def __init__(self, token, chat_id):
+        self.api = f"{TG_API_BASE}/bot{token}"
+        self.chat_id = chat_id
+        self.session = requests.Session()
+        self.global_bucket = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        self.chat_bucket = TokenBucket(TG_CHAT_RATE_PER_MIN / 60, TG_CHAT_BURST)
+
+    def _photo(self, poster, name, files):
+        """Reference to send for poster; None means the bytes go in files[name]."""
+        if poster.file_id:
+            return poster.file_id
+        url = poster.url or f"{TMDB_IMAGE_BASE}/{poster.jpg}"
+        if TG_SEND_BY_URL:
+            return url
+        try:
+            files[name] = open(poster_cache.path(poster.jpg), "rb")
+        except FileNotFoundError:
+            return url
+        return None
+
+    def _post(self, method, data, files, extra):
+        """POST within the rate limits; returns (result or None, last HTTP status)."""
+        for attempt in range(1, TG_SEND_ATTEMPTS + 1):
+            self.chat_bucket.acquire()
+            self.global_bucket.acquire()
+            for f in files.values():
+                f.seek(0)
+            start = time.perf_counter()
+            timeout = TG_REQUEST_TIMEOUT + TG_UPLOAD_TIMEOUT_PER_PHOTO * len(files)
+            response = self.session.post(f"{self.api}/{method}", data=data, files=files or None, timeout=timeout)
+            PUBLISH_SECONDS.observe(time.perf_counter() - start, method=method,
+                                    outcome={200: 'ok', 429: 'rate_limited'}.get(response.status_code, 'error'))
+            if response.status_code == 200:
+                return response.json()['result'], 200
+            if response.status_code == 429:
+                try:
+                    retry_after = response.json()['parameters']['retry_after']
+                except (ValueError, KeyError, TypeError):
+                    retry_after = 1
+                self.chat_bucket.pause(retry_after)
+                logger.warning("Telegram rate limit hit",
+                              extra={**extra, 'http_status': 429, 'retry_after': retry_after, 'attempt': attempt})
+                continue
+            logger.error("Failed to publish poster",
+                        extra={**extra, 'status': 'error',
+                               'http_status': response.status_code,
+                               'response': response.text[:200]})
+            return None, response.status_code
+        return None, 429
+
+    def send(self, posters):
+        """Publish posters as one album (or one photo).
+
+        Returns the Telegram file_id for each poster, None where it failed
+        and THROTTLED where Telegram kept rate-limiting the request.
+        """
+        files = {}
+        extra = {
+            'component': 'telegram',
+            'movie_id': ','.join(p.movie_id for p in posters),
+            'operation': 'send_photo' if len(posters) == 1 else 'send_media_group',
+            'batch_size': len(posters)
+        }
+        status = None
+        try:
+            if len(posters) == 1:
+                data = {"chat_id": self.chat_id, "caption": caption(posters[0]), "parse_mode": "HTML"}
+                if (photo := self._photo(posters[0], "photo", files)):
+                    data["photo"] = photo
+                result, status = self._post("sendPhoto", data, files, extra)
+                messages = result and [result]
+            else:
+                media = [{"type": "photo", "caption": caption(p), "parse_mode": "HTML",
+                          "media": self._photo(p, f"photo{i}", files) or f"attach://photo{i}"}
+                         for i, p in enumerate(posters)]
+                data = {"chat_id": self.chat_id, "media": json.dumps(media)}
+                messages, status = self._post("sendMediaGroup", data, files, extra)
+        except Exception as e:
+            logger.error("Exception publishing poster",
+                        extra={**extra, 'error': str(e)},
+                        exc_info=True)
+            messages = None
+        finally:
+            for f in files.values():
+                f.close()
+
+        if messages:
             logger.info("Poster published successfully",
                        extra={**extra, 'status': 'success', 'http_status': 200})
-            return True
-            
-        logger.error("Failed to publish poster",
-                    extra={**extra, 'status': 'error',
-                           'http_status': response.status_code,
-                           'response': response.text[:200]})
-        return False
-    except Exception as e:
-        logger.error("Exception publishing poster",
-                    extra={**extra, 'error': str(e)},
-                    exc_info=True)
-        return False
+            # Largest size last; its file_id re-sends the same photo without bytes.
+            return [m['photo'][-1]['file_id'] for m in messages]
+        if status == 429:
+            return [THROTTLED] * len(posters)
+        if len(posters) > 1 and status in TG_REJECTED_STATUSES:
+            # One broken poster fails the whole album; send one by one to isolate it.
+            return [self.send([p])[0] for p in posters]
+        # 5xx, timeouts and other errors: the album may even have
+        # gone through, so it is never re-sent photo by photo; it is retried
+        # as a whole after the backoff.
+        return [None] * len(posters)
+
+    @staticmethod
+    def groups(posters):
+        """Split posters into consecutive albums of up to TG_MEDIA_GROUP_SIZE."""
+        return [posters[i:i + TG_MEDIA_GROUP_SIZE] for i in range(0, len(posters), TG_MEDIA_GROUP_SIZE)]
+
+
+sender = TelegramSender(TG_FILM_BOT_TOKEN, TG_CHAT_ID)
+
+# Albums are sent by a pool of workers; the rate limits are shared, so
+# throughput scales with concurrency until Telegram's limit is reached.
+# TG_ORDERED keeps channel order by ingest time with a single worker (run
+# a single replica too: replicas publish their batches side by side).
+TG_ORDERED = os.environ.get('TG_ORDERED', '').lower() in ('1', 'true', 'yes')
+TG_PUBLISH_CONCURRENCY = 1 if TG_ORDERED else max(1, int(os.environ.get('TG_PUBLISH_CONCURRENCY', 4)))
+publisher_pool = ThreadPoolExecutor(max_workers=TG_PUBLISH_CONCURRENCY, thread_name_prefix='publisher')
+
+# Set by SIGTERM/SIGINT: no new albums are started, in-flight ones finish.
+shutting_down = threading.Event()
+
+
+def backfill_pending():
+    """Queue unpublished posters stored before the pending index existed.
+
+    Uses SCAN, so it never blocks Redis; ZADD NX keeps existing ingest times.
+    Posters already claimed, waiting for a retry or dead-lettered are left
+    where they are. Published posters still kept as full hashes (stored
+    before the archive existed) are moved into the archive. Only the
+    replica holding the backfill lease runs it.
+    """
+    lease = Lease(r, 'tg:backfill', ttl=300)
+    if not lease.acquire():
+        return
+    keys = list(r.scan_iter(match=POSTER_KEY.format('*'), count=1000))
+    queued = archived = 0
+    for i in range(0, len(keys), 1000):
+        chunk = keys[i:i + 1000]
+        pipe = batch.pipeline()
+        for key in chunk:
+            pipe.hgetall(key)
+            for index in (INFLIGHT_KEY, RETRY_KEY, DEAD_KEY):
+                pipe.zscore(index, key)
+        results = batch.execute(pipe, 'backfill_status', len(chunk))
+        unpublished = {}
+        pipe = batch.pipeline()
+        for j, key in enumerate(chunk):
+            data, *scores = results[4 * j:4 * j + 4]
+            if data.get(b'status') == b'published':
+                queue_archive(pipe, key.split(b':', 1)[1].decode(), data.get(b'jpg', b'').decode(),
+                              data.get(b'vote_average', b'').decode(), data.get(b'file_id', b'').decode())
+                archived += 1
+            elif data and all(score is None for score in scores):
+                unpublished[key] = time.time()
+        if unpublished:
+            queued += r.zadd(PENDING_KEY, unpublished, nx=True)
+        if len(pipe):
+            batch.execute(pipe, 'backfill_archive', len(pipe) // 2)
+    lease.release()
+    logger.info("Pending index backfilled",
+                extra={'component': 'processor', 'operation': 'backfill', 'queued': queued,
+                       'archived': archived})
+
+
+def wait_for_posters(timeout):
+    """Block until the tmdb service signals new posters, timeout passes or shutdown starts."""
+    deadline = time.monotonic() + timeout
+    while not shutting_down.is_set() and (remaining := deadline - time.monotonic()) > 0:
+        try:
+            # Short slices so a shutdown signal is noticed within a few seconds.
+            if r_blocking.blpop([NOTIFY_KEY], timeout=min(remaining, 5)):
+                # Several pushes may have queued wake-ups; one sweep covers them all.
+                r_blocking.delete(NOTIFY_KEY)
+                return True
+        except redis.RedisError as e:
+            logger.error("Waiting for notification failed",
+                        extra={'component': 'processor', 'operation': 'wait', 'error': str(e)},
+                        exc_info=True)
+            time.sleep(1)
+    return False
+
+
+def retry_delay(attempts):
+    """Exponential backoff with equal jitter for the given number of failed attempts."""
+    delay = min(TG_RETRY_MAX_DELAY, TG_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def record_results(group, file_ids, extra):
+    """Record one album's outcome in a single round trip; returns how many were published.
+
+    Published posters move from their hash into the compact archive and
+    their files leave the shared volume. Failed posters leave the in-flight
+    set for the retry set, or for the dead-letter set once they have used
+    up TG_MAX_ATTEMPTS. Throttled posters wait out the rate limit in the
+    retry set without spending an attempt.
+    """
+    pipe = batch.pipeline()
+    now = time.time()
+    published = 0
+    for poster, file_id in zip(group, file_ids):
+        movie_extra = {**extra, 'movie_id': poster.movie_id}
+        pipe.zrem(INFLIGHT_KEY, poster.key)
+        if file_id is THROTTLED:
+            delay = max(1.0, sender.chat_bucket.wait_time())
+            pipe.zadd(RETRY_KEY, {poster.key: now + delay})
+            POSTERS_FAILED.inc(outcome='throttled')
+            logger.warning("Poster publication throttled",
+                          extra={**movie_extra, 'attempts': poster.attempts, 'retry': True,
+                                 'retry_in_s': round(delay, 1)})
+            continue
+        if file_id:
+            queue_archive(pipe, poster.movie_id, poster.jpg, poster.vote_average, file_id)
+            published += 1
+            logger.info("Poster status updated",
+                        extra={**movie_extra, 'new_status': 'published'})
+            continue
+        attempts = poster.attempts + 1
+        pipe.hset(poster.key, "attempts", attempts)
+        if attempts >= TG_MAX_ATTEMPTS:
+            pipe.zadd(DEAD_KEY, {poster.key: now})
+            POSTERS_FAILED.inc(outcome='dead')
+            logger.error("Poster dead-lettered",
+                        extra={**movie_extra, 'attempts': attempts, 'retry': False})
+        else:
+            delay = retry_delay(attempts)
+            pipe.zadd(RETRY_KEY, {poster.key: now + delay})
+            POSTERS_FAILED.inc(outcome='retry')
+            logger.warning("Poster publication failed",
+                          extra={**movie_extra, 'attempts': attempts, 'retry': True,
+                                 'retry_in_s': round(delay, 1)})
+    batch.execute(pipe, 'record_results', len(group))
+    # Files of posters that will be retried stay, even if a published one shares them.
+    sent = {poster.jpg for poster, file_id in zip(group, file_ids) if file_id and file_id is not THROTTLED}
+    unsent = {poster.jpg for poster, file_id in zip(group, file_ids) if not file_id or file_id is THROTTLED}
+    poster_cache.discard(sent - unsent)
+    POSTERS_PUBLISHED.inc(published)
+    return published
+
+
+def release_claims(posters):
+    """Hand claimed posters that were not attempted back to the pending set."""
+    pipe = batch.pipeline()
+    for poster in posters:
+        pipe.zrem(INFLIGHT_KEY, poster.key)
+        pipe.zadd(PENDING_KEY, {poster.key: time.time()})
+    batch.execute(pipe, 'release_claims', len(posters))
+
+
+def requeue_dead(poster_ids=()):
+    """Move dead-lettered posters (all, or the given poster ids) back to pending with a fresh attempt budget.
+
+    Ids that are not dead-lettered (unknown, pending or waiting for a retry)
+    are skipped; returns how many posters were requeued.
+    """
+    keys = [POSTER_KEY.format(poster_id) for poster_id in poster_ids]
+    moved = batch.requeue(DEAD_KEY, PENDING_KEY, time.time(), "attempts", keys)
+    skipped = sorted(set(keys) - {key.decode() for key in moved})
+    if skipped:
+        logger.warning("Not dead-lettered, left as is",
+                       extra={'component': 'processor', 'operation': 'requeue_dead', 'keys': skipped})
+    logger.info("Dead letters requeued",
+                extra={'component': 'processor', 'operation': 'requeue_dead', 'count': len(moved)})
+    return len(moved)
 
 
 def process_posters():
-    """Process posters queue from Redis."""
+    """Publish the pending posters from Redis, oldest first; returns how many were published."""
     trace_id = str(uuid.uuid4())
     extra = {
         'component': 'processor',
@@ -145,50 +406,106 @@ def process_posters():
         'trace_id': trace_id
     }
     
+    published = 0
+    start = time.perf_counter()
     try:
         logger.info("Starting posters processing", extra=extra)
-        all_poster_keys = r.keys(b"poster:*")
-        logger.info("Found poster keys",
-                   extra={**extra, 'key_count': len(all_poster_keys)})
+        now = time.time()
+        batch.move_due(RETRY_KEY, PENDING_KEY, now)
+        # Claims of replicas that died mid-cycle.
+        batch.move_due(INFLIGHT_KEY, PENDING_KEY, now)
+        pending_keys = batch.claim(PENDING_KEY, INFLIGHT_KEY, now, TG_CLAIM_TTL, PENDING_BATCH)
+        pipe = batch.pipeline()
+        for key in (PENDING_KEY, RETRY_KEY, DEAD_KEY, INFLIGHT_KEY):
+            pipe.zcard(key)
+        depths = batch.execute(pipe, 'queue_depth', 4)
+        for queue, depth in zip(('pending', 'retry', 'dead', 'inflight'), depths):
+            QUEUE_DEPTH.set(depth, queue=queue)
+        logger.info("Found pending posters",
+                   extra={**extra, 'key_count': len(pending_keys)})
 
-        for key in all_poster_keys:
+        # One pipelined round trip for all hashes instead of an HGETALL per key.
+        posters = []
+        for key, poster_data in zip(pending_keys, batch.hgetall_many(pending_keys)):
             key_str = key.decode('utf-8')
-            movie_id = key_str.split(':')[1]
+            movie_id = key_str.split(':', 1)[1]
 
-            poster_data = r.hgetall(key)
             status = poster_data.get(b'status', b'').decode('utf-8')
-            movie_extra = {**extra, 'movie_id': movie_id}
 
-            if status == "published":
-                logger.debug("Skipping published poster", 
-                            extra={**movie_extra, 'status': 'skipped'})
+            if not poster_data or status == "published":
+                r.zrem(INFLIGHT_KEY, key)
+                logger.debug("Dropped stale pending entry",
+                            extra={**extra, 'movie_id': movie_id, 'status': status or 'missing'})
                 continue
 
-            jpg = poster_data.get(b'jpg', b'').decode('utf-8')
-            vote_average = poster_data.get(b'vote_average', b'').decode('utf-8')
+            posters.append(Poster(
+                key, movie_id,
+                poster_data.get(b'jpg', b'').decode('utf-8'),
+                poster_data.get(b'url', b'').decode('utf-8') or None,
+                poster_data.get(b'vote_average', b'').decode('utf-8'),
+                poster_data.get(b'file_id', b'').decode('utf-8') or None,
+                int(poster_data.get(b'attempts', 0))))
 
-            if publish_poster(movie_id, jpg, vote_average):
-                r.hset(key, "status", "published")
-                logger.info("Poster status updated",
-                            extra={**movie_extra, 'new_status': 'published'})
-            else:
-                logger.warning("Poster publication failed",
-                              extra={**movie_extra, 'retry': True})
+        futures = {publisher_pool.submit(sender.send, group): group for group in sender.groups(posters)}
+        unsent = []
+        for future in as_completed(futures):
+            if shutting_down.is_set():
+                # Drain: albums not started yet go back to pending for the next run.
+                for pending in futures:
+                    pending.cancel()
+            try:
+                file_ids = future.result()
+            except CancelledError:
+                unsent.extend(futures[future])
+                continue
+            published += record_results(futures[future], file_ids, extra)
+        if unsent:
+            release_claims(unsent)
     
     except Exception as e:
         logger.error("Poster processing failed",
                     extra={**extra, 'error': str(e)},
                     exc_info=True)
+    CYCLE_SECONDS.observe(time.perf_counter() - start)
+    return published
+
+
+def next_wait():
+    """Seconds until the reconciliation sweep or the earliest due retry, whichever comes first."""
+    interval = reconcile.next()
+    earliest = r.zrange(RETRY_KEY, 0, 0, withscores=True)
+    if earliest:
+        return max(0.1, min(interval, earliest[0][1] - time.time()))
+    return interval
+
+
+def request_shutdown(signum, frame):
+    logger.info("Shutdown requested, draining publishers",
+                extra={'component': 'main', 'operation': 'shutdown', 'signal': signum})
+    shutting_down.set()
 
 
 if __name__ == "__main__":
-    # In a production environment you might want to wrap this in a loop
-    # or use a scheduler to run periodically.
-    process_posters()
-    # main_job()
-    
-    # Планируем запуск основного задания каждые 40 секунд
-    schedule.every(40).seconds.do(process_posters)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    if sys.argv[1:2] == ["dead-letters"]:
+        for key, failed_at in r.zrange(DEAD_KEY, 0, -1, withscores=True):
+            print(key.decode(), time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(failed_at)))
+        sys.exit(0)
+    if sys.argv[1:2] == ["requeue-dead"]:
+        print(f"requeued {requeue_dead(sys.argv[2:])}")
+        sys.exit(0)
+
+    metrics.start_metrics_server(METRICS_PORT)
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    configure_compact_encoding(r)
+    backfill_pending()
+    # Publish as soon as the tmdb service signals new posters; the BLPOP
+    # timeout doubles as the reconciliation sweep. A full batch means more
+    # may be pending, so sweep again without waiting.
+    while not shutting_down.is_set():
+        published = process_posters()
+        reconcile.update(published)
+        if published < PENDING_BATCH:
+            wait_for_posters(next_wait())
+    publisher_pool.shutdown(wait=True, cancel_futures=True)
+    logger.info("Shutdown complete", extra={'component': 'main', 'operation': 'shutdown'})
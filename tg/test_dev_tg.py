@@ -0,0 +1,191 @@
+import os
+import json
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import pytest
+import redis
+import requests
+
+from common import redis_batch
+from common.archive import get_archived
+from common.ratelimit import TokenBucket
+
+SERVER = fakeredis.FakeServer()
+
+# dev_tg connects to Redis and reads its settings on import.
+with patch.dict(os.environ, {'REDIS_HOST': 'localhost', 'REDIS_PORT': '6379', 'TG_CHAT_ID': '-1',
+                             'TG_FILM_BOT_TOKEN': 'token', 'TG_RETRY_BASE_DELAY': '0'}), \
+        patch.object(redis, 'Redis', lambda **kwargs: fakeredis.FakeRedis(server=SERVER)):
+    from . import dev_tg
+
+
+@pytest.fixture(autouse=True)
+def clean(monkeypatch, tmp_path):
+    dev_tg.r.flushall()
+    dev_tg.shutting_down.clear()
+    monkeypatch.setattr(dev_tg, 'logger', MagicMock())
+    monkeypatch.setattr(redis_batch, 'logger', MagicMock())
+    monkeypatch.setattr(dev_tg.sender, 'chat_bucket', TokenBucket(1000, 1000))
+    monkeypatch.setattr(dev_tg.sender, 'global_bucket', TokenBucket(1000, 1000))
+    monkeypatch.setattr(dev_tg.sender, 'session', MagicMock())
+    monkeypatch.setattr(dev_tg, 'poster_cache', dev_tg.PosterCache(str(tmp_path)))
+    monkeypatch.setattr(dev_tg, 'TG_SEND_BY_URL', True)
+    yield
+    dev_tg.shutting_down.clear()
+
+
+def _response(status, payload=None):
+    response = MagicMock()
+    response.status_code = status
+    response.json.return_value = payload
+    response.text = json.dumps(payload)
+    return response
+
+
+def _photo(file_id):
+    return {'photo': [{'file_id': f'{file_id}-small'}, {'file_id': file_id}]}
+
+
+def _poster(n, attempts=0):
+    return dev_tg.Poster(f'poster:movie:{n}', f'movie:{n}', f'{n}.jpg', f'https://image.tmdb.org/t/p/w342/{n}.jpg',
+                         '7.5', None, attempts)
+
+
+def _queue(*ns):
+    for n in ns:
+        dev_tg.r.hset(f'poster:movie:{n}', mapping={'jpg': f'{n}.jpg', 'vote_average': '7.5', 'status': 'ready'})
+        dev_tg.r.zadd(dev_tg.PENDING_KEY, {f'poster:movie:{n}': n})
+
+
+def test_send_waits_out_a_rate_limit_and_retries():
+    post = dev_tg.sender.session.post
+    post.side_effect = [_response(429, {'parameters': {'retry_after': 0}}), _response(200, {'result': _photo('f1')})]
+    assert dev_tg.sender.send([_poster(1)]) == ['f1']
+    assert post.call_count == 2
+
+
+def test_rejected_album_is_sent_photo_by_photo():
+    post = dev_tg.sender.session.post
+    post.side_effect = [_response(400, {'description': 'IMAGE_PROCESS_FAILED'}),
+                        _response(200, {'result': _photo('f1')}),
+                        _response(400, {'description': 'IMAGE_PROCESS_FAILED'}),
+                        _response(200, {'result': _photo('f3')})]
+    assert dev_tg.sender.send([_poster(1), _poster(2), _poster(3)]) == ['f1', None, 'f3']
+    assert [c.args[0].rsplit('/', 1)[1] for c in post.call_args_list] == [
+        'sendMediaGroup', 'sendPhoto', 'sendPhoto', 'sendPhoto']
+
+
+def test_send_by_url_uses_the_variant_tmdb_recorded():
+    post = dev_tg.sender.session.post
+    post.return_value = _response(200, {'result': _photo('f1')})
+    dev_tg.sender.send([_poster(1)])
+    assert post.call_args.kwargs['data']['photo'] == 'https://image.tmdb.org/t/p/w342/1.jpg'
+    # Records stored before tmdb recorded the URL fall back to TMDB_IMAGE_BASE.
+    dev_tg.sender.send([_poster(2)._replace(url=None)])
+    assert post.call_args.kwargs['data']['photo'] == f'{dev_tg.TMDB_IMAGE_BASE}/2.jpg'
+
+
+@pytest.mark.parametrize('outcome', [requests.ReadTimeout('read timed out'), _response(502, {})])
+def test_album_is_not_split_after_a_timeout_or_server_error(outcome):
+    post = dev_tg.sender.session.post
+    post.side_effect = [outcome]
+    assert dev_tg.sender.send([_poster(1), _poster(2)]) == [None, None]
+    post.assert_called_once()
+
+
+def test_failing_poster_is_retried_then_dead_lettered(monkeypatch):
+    monkeypatch.setattr(dev_tg, 'TG_MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(dev_tg.sender, 'send', lambda posters: [None] * len(posters))
+    _queue(1)
+    for attempt in range(1, 4):
+        assert dev_tg.process_posters() == 0
+        # Make the retry due right away.
+        for key in dev_tg.r.zrange(dev_tg.RETRY_KEY, 0, -1):
+            dev_tg.r.zadd(dev_tg.RETRY_KEY, {key: 0})
+        assert int(dev_tg.r.hget('poster:movie:1', 'attempts')) == attempt
+    assert dev_tg.r.zrange(dev_tg.DEAD_KEY, 0, -1) == [b'poster:movie:1']
+    for index in (dev_tg.PENDING_KEY, dev_tg.RETRY_KEY, dev_tg.INFLIGHT_KEY):
+        assert dev_tg.r.zcard(index) == 0
+
+
+def test_rate_limited_poster_is_retried_without_spending_attempts(monkeypatch):
+    monkeypatch.setattr(dev_tg, 'TG_MAX_ATTEMPTS', 2)
+    dev_tg.sender.session.post.return_value = _response(429, {'parameters': {'retry_after': 0}})
+    _queue(1)
+    for _ in range(3):
+        assert dev_tg.process_posters() == 0
+        assert dev_tg.r.zscore(dev_tg.RETRY_KEY, 'poster:movie:1') is not None
+        dev_tg.r.zadd(dev_tg.RETRY_KEY, {'poster:movie:1': 0})
+    assert dev_tg.r.hget('poster:movie:1', 'attempts') is None
+    assert dev_tg.r.zcard(dev_tg.DEAD_KEY) == 0
+
+
+def test_published_posters_are_archived():
+    dev_tg.sender.session.post.return_value = _response(200, {'result': [_photo('f1'), _photo('f2')]})
+    _queue(1, 2)
+    assert dev_tg.process_posters() == 2
+    assert not dev_tg.r.exists('poster:movie:1', 'poster:movie:2')
+    assert get_archived(dev_tg.r, 'movie:2') == {'jpg': '2.jpg', 'vote_average': '7.5', 'file_id': 'f2'}
+    assert dev_tg.r.zcard(dev_tg.INFLIGHT_KEY) == 0
+
+
+class _QueuedFuture(Future):
+    def cancel(self):
+        if self.done():
+            return self.cancelled()
+        super().cancel()
+        # What a pool worker does when it dequeues a cancelled item.
+        self.set_running_or_notify_cancel()
+        return True
+
+
+class _FirstOnlyPool:
+    """Runs the first album, then shutdown starts; later albums stay queued."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        future = _QueuedFuture()
+        self.submitted += 1
+        if self.submitted == 1:
+            future.set_result(fn(*args))
+            dev_tg.shutting_down.set()
+        return future
+
+
+def test_albums_not_started_at_shutdown_go_back_to_pending(monkeypatch):
+    monkeypatch.setattr(dev_tg, 'TG_MEDIA_GROUP_SIZE', 2)
+    monkeypatch.setattr(dev_tg, 'publisher_pool', _FirstOnlyPool())
+    monkeypatch.setattr(dev_tg.sender, 'send', lambda posters: [f'f{p.movie_id}' for p in posters])
+    _queue(1, 2, 3, 4, 5)
+    assert dev_tg.process_posters() == 2
+    assert sorted(dev_tg.r.zrange(dev_tg.PENDING_KEY, 0, -1)) == [b'poster:movie:3', b'poster:movie:4',
+                                                                   b'poster:movie:5']
+    assert dev_tg.r.zcard(dev_tg.INFLIGHT_KEY) == 0
+
+
+def test_requeue_dead_skips_ids_that_are_not_dead_lettered():
+    _queue(1)
+    dev_tg.r.zadd(dev_tg.DEAD_KEY, {'poster:movie:2': 1})
+    dev_tg.r.hset('poster:movie:2', mapping={'jpg': '2.jpg', 'attempts': 8})
+    dev_tg.r.zadd(dev_tg.RETRY_KEY, {'poster:movie:3': 1})
+    assert dev_tg.requeue_dead(['movie:1', 'movie:2', 'movie:3', 'movie:999']) == 1
+    assert dev_tg.r.hget('poster:movie:2', 'attempts') == b'0'
+    assert not dev_tg.r.exists('poster:movie:999')
+    assert dev_tg.r.zscore(dev_tg.PENDING_KEY, 'poster:movie:3') is None
+    assert dev_tg.r.zcard(dev_tg.DEAD_KEY) == 0
+
+
+def test_backfill_queues_unpublished_and_archives_published_hashes():
+    dev_tg.r.hset('poster:movie:1', mapping={'jpg': '1.jpg', 'vote_average': '7', 'status': 'ready'})
+    dev_tg.r.hset('poster:movie:2', mapping={'jpg': '2.jpg', 'vote_average': '6', 'status': 'published',
+                                             'file_id': 'f2'})
+    dev_tg.r.hset('poster:movie:3', mapping={'jpg': '3.jpg', 'vote_average': '5', 'status': 'ready'})
+    dev_tg.r.zadd(dev_tg.DEAD_KEY, {'poster:movie:3': 1})
+    dev_tg.backfill_pending()
+    assert dev_tg.r.zrange(dev_tg.PENDING_KEY, 0, -1) == [b'poster:movie:1']
+    assert not dev_tg.r.exists('poster:movie:2')
+    assert get_archived(dev_tg.r, 'movie:2')['file_id'] == 'f2'
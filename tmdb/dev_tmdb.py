@@ -1,73 +1,34 @@
 import os
 import time
-import json
-import logging
-import socket
+import io
+import asyncio
+import functools
+import threading
 import uuid
-import traceback
+from collections import namedtuple, Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import requests
 import redis
-import schedule
 from dotenv import load_dotenv
-from pythonjsonlogger import jsonlogger
-
-
-class CustomJsonFormatter(jsonlogger.JsonFormatter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.hostname = socket.gethostname()
-        self.pod_name = os.getenv('POD_NAME', self.hostname)
-        self.namespace = os.getenv('POD_NAMESPACE', 'default')
-        self.service_name = os.getenv('SERVICE_NAME', 'tmdb-service')
-        self.app_version = os.getenv('APP_VERSION', '1.0.0')
-
-    def add_fields(self, log_record, record, message_dict):
-        super().add_fields(log_record, record, message_dict)
-        log_record.update({
-            'timestamp': record.created,
-            'level': record.levelname,
-            'logger': record.name,
-            'service': self.service_name,
-            'hostname': self.hostname,
-            'pod': self.pod_name,
-            'namespace': self.namespace,
-            'version': self.app_version,
-            'file': record.pathname,
-            'line': record.lineno,
-            'function': record.funcName,
-        })
-        if record.exc_info:
-            log_record['exception'] = traceback.format_exception(*record.exc_info)
-        if trace_id := getattr(record, 'trace_id', None):
-            log_record['trace_id'] = trace_id
-
-
-def setup_logging():
-    level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    level = getattr(logging, level, logging.INFO)
-    root = logging.getLogger()
-    root.setLevel(level)
-    for h in root.handlers:
-        root.removeHandler(h)
-    console = logging.StreamHandler()
-    fmt = '%(timestamp)s %(level)s [%(service)s] [%(trace_id)s] %(message)s'
-    console.setFormatter(CustomJsonFormatter(fmt))
-    root.addHandler(console)
-    for name in ('requests', 'urllib3', 'schedule'):
-        logging.getLogger(name).setLevel(logging.WARNING)
-    return root
-
-
-class RequestContextFilter(logging.Filter):
-    def __init__(self):
-        super().__init__()
-        self.trace_id = str(uuid.uuid4())
-
-    def filter(self, record):
-        record.trace_id = getattr(record, 'trace_id', self.trace_id)
-        return True
-
+from requests.adapters import HTTPAdapter
+
+try:
+    from PIL import Image
+except ImportError:  # recompression (POSTER_MAX_BYTES) is optional
+    Image = None
+
+from common import metrics
+from common.archive import archive_location, exists_many
+from common.leases import claim_many, release_many
+from common.log import setup_logging
+from common.poster_cache import PosterCache, pinned_files
+from common.ratelimit import TokenBucket
+from common.redis_batch import RedisBatch
+from common.scheduler import Scheduler
+from common.schema import (CLAIM_KEY, DEAD_KEY, INFLIGHT_KEY, LEGACY_KNOWN_KEY, MISSING_KEY, NOTIFY_KEY,
+                           PENDING_KEY, POSTER_KEY, RETRY_KEY)
+from common.tunnels import TunnelPool, TunnelsDown
 
 
 def get_redis_client():
@@ -83,104 +44,615 @@ def get_redis_client():
     client.ping()
     return client
 
-logger = setup_logging()
+
+def get_http_session():
+    # One keep-alive pool per host (api.themoviedb.org, image.tmdb.org), reused
+    # through the socks5h proxy instead of a new handshake per request.
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                          pool_maxsize=HTTP_POOL_MAXSIZE)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if PROXIES:
+        session.proxies.update(PROXIES)
+    return session
+
+logger = setup_logging('tmdb-service')
 
 # Module-level variables for requests
 HEADERS = None
 PROXIES = None
+# Healthy tunnels published by the tunnel service; requests fall back to
+# PROXIES when it is not set.
+tunnel_pool = None
 redis_client = None
+redis_batch = None
+http_session = None
+
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 4))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+
+# TMDB allows roughly 40-50 requests per second per IP; stay below that.
+TMDB_CONCURRENCY = int(os.getenv('TMDB_CONCURRENCY', 8))
+TMDB_RATE_LIMIT = float(os.getenv('TMDB_RATE_LIMIT', 35))
+TMDB_RATE_BURST = int(os.getenv('TMDB_RATE_BURST', 10))
+
+# Favorites list key in URLS -> TMDB media type used by the /images endpoints.
+MEDIA_TYPES = {'movies': 'movie', 'tv': 'tv'}
+
+
+
+class FavoriteItem(namedtuple('FavoriteItem', ['media_type', 'id', 'vote_average'])):
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """Poster id used everywhere in Redis; movie and tv ids overlap, so it carries the type."""
+        return f"{self.media_type}:{self.id}"
+
+
+# Overridable so the offline benchmark can point the service at local stand-ins.
+TMDB_API_BASE = os.getenv('TMDB_API_BASE', 'https://api.themoviedb.org/3').rstrip('/')
+
+IMAGE_TEMPLATES = {
+    'movie': f"{TMDB_API_BASE}/movie/{{}}/images?language=ru",
+    'tv': f"{TMDB_API_BASE}/tv/{{}}/images?language=ru"
+}
+
+POSTERS_DIR = 'jpgs'
+# Off when the Telegram service sends posters by URL (TG_SEND_BY_URL).
+DOWNLOAD_POSTERS = os.getenv('TMDB_DOWNLOAD_POSTERS', 'true').lower() in ('1', 'true', 'yes')
+POSTER_DOWNLOAD_WORKERS = int(os.getenv('POSTER_DOWNLOAD_WORKERS', 4))
+POSTER_CHUNK_SIZE = 64 * 1024
+# jpgs/ is capped at POSTER_CACHE_MAX_BYTES / POSTER_CACHE_MAX_FILES (0: no
+# cap): after each download the least recently used files of published
+# posters are evicted. The Telegram service deletes files once published,
+# and files no unpublished poster references are removed on startup.
+POSTER_CACHE_MAX_BYTES = int(os.getenv('POSTER_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+POSTER_CACHE_MAX_FILES = int(os.getenv('POSTER_CACHE_MAX_FILES', 5000))
+poster_cache = None
+JPEG_EOI = b'\xff\xd9'
+
+# Poster variant: POSTER_SIZE names one explicitly (e.g. 'w342'), otherwise
+# the smallest size at least POSTER_WIDTH wide from /configuration is used.
+CONFIGURATION_URL = f"{TMDB_API_BASE}/configuration"
+POSTER_SIZE = os.getenv('POSTER_SIZE')
+POSTER_WIDTH = int(os.getenv('POSTER_WIDTH', 500))
+IMAGE_CONFIG_TTL = 24 * 3600
+DEFAULT_IMAGE_BASE = 'https://image.tmdb.org/t/p/w500'
+image_base = None
+image_base_expires = 0
+
+# Posters larger than POSTER_MAX_BYTES are re-encoded (lower quality, then
+# smaller) in a process pool before they are published; 0 disables it.
+POSTER_MAX_BYTES = int(os.getenv('POSTER_MAX_BYTES', 0))
+POSTER_ENCODE_WORKERS = int(os.getenv('POSTER_ENCODE_WORKERS', 2))
+encode_pool = None
+
+# Replicas claim each new favorite before resolving and downloading it, so
+# every poster is handled by one of them. Claims are dropped at the end of
+# the job; those of a replica that died expire after TMDB_CLAIM_TTL seconds.
+TMDB_CLAIM_TTL = float(os.getenv('TMDB_CLAIM_TTL', 600))
+
+# Favorites TMDB has no poster for are looked up again only after
+# TMDB_MISSING_TTL seconds instead of on every cycle.
+TMDB_MISSING_TTL = float(os.getenv('TMDB_MISSING_TTL', 24 * 3600))
+
+# Favorites pages are fetched concurrently after page 1 reports total_pages.
+TMDB_PAGE_CONCURRENCY = int(os.getenv('TMDB_PAGE_CONCURRENCY', 4))
+
+# Blocking calls made from the asyncio resolver (HTTP requests, Redis
+# batches) and poster downloads run on these long-lived pools instead of a
+# new executor per cycle.
+io_pool = ThreadPoolExecutor(max_workers=TMDB_CONCURRENCY + TMDB_PAGE_CONCURRENCY + 1, thread_name_prefix='tmdb-io')
+download_pool = ThreadPoolExecutor(max_workers=max(1, POSTER_DOWNLOAD_WORKERS), thread_name_prefix='download')
+
+# main_job runs every TMDB_JOB_INTERVAL seconds to start with; cycles that
+# find new favorites halve the interval (down to the minimum) and idle ones
+# stretch it by half (up to the maximum).
+TMDB_JOB_INTERVAL = float(os.getenv('TMDB_JOB_INTERVAL', 40))
+TMDB_JOB_MIN_INTERVAL = float(os.getenv('TMDB_JOB_MIN_INTERVAL', 10))
+TMDB_JOB_MAX_INTERVAL = float(os.getenv('TMDB_JOB_MAX_INTERVAL', 300))
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9101))
+REQUEST_SECONDS = metrics.Histogram('tmdb_request_seconds', 'TMDB API request latency by cache outcome.', ['cache'])
+DOWNLOAD_SECONDS = metrics.Histogram('tmdb_poster_download_seconds', 'Time to store one poster by outcome.', ['outcome'])
+JOB_SECONDS = metrics.Histogram('tmdb_job_seconds', 'Duration of one main_job cycle by outcome.', ['outcome'])
+POSTERS_ADDED = metrics.Counter('tmdb_posters_added_total', 'Posters inserted into Redis for publishing.')
+TUNNEL_REJECTIONS = metrics.Counter('tmdb_tunnel_rejections_total', 'Requests failed fast because no tunnel was healthy.')
 
 URLS = {
-    'movies': f"https://api.themoviedb.org/3/account/{os.getenv('TMDB_ACCOUNT_ID')}/favorite/movies?language=en-US&page=1&sort_by=created_at.asc",
-    'tv': f"https://api.themoviedb.org/3/account/{os.getenv('TMDB_ACCOUNT_ID')}/favorite/tv?language=en-US&page=1&sort_by=created_at.asc"
+    'movies': f"{TMDB_API_BASE}/account/{os.getenv('TMDB_ACCOUNT_ID')}/favorite/movies?language=en-US&page={{page}}&sort_by=created_at.asc",
+    'tv': f"{TMDB_API_BASE}/account/{os.getenv('TMDB_ACCOUNT_ID')}/favorite/tv?language=en-US&page={{page}}&sort_by=created_at.asc"
 }
 
 
+# Parsed JSON responses are kept in memory so a fresh hit or a 304 skips both
+# the body transfer and json parsing. Freshness from Cache-Control is capped.
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+HTTP_CACHE_MAX_TTL = int(os.getenv('HTTP_CACHE_MAX_TTL', 300))
+
+CacheEntry = namedtuple('CacheEntry', ['data', 'etag', 'last_modified', 'expires', 'size'])
+
+
+class ResponseCache:
+    """LRU of parsed responses bounded by total body size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            if (entry := self.entries.get(url)) is not None:
+                self.entries.move_to_end(url)
+            return entry
+
+    def record(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def put(self, url, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if (old := self.entries.pop(url, None)) is not None:
+                self.size -= old.size
+            self.entries[url] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def stats(self, reset=True):
+        with self._lock:
+            stats = {'hits': self.counts['hit'], 'misses': self.counts['miss'],
+                     'revalidated': self.counts['revalidated'], 'entries': len(self.entries), 'bytes': self.size}
+            if reset:
+                self.counts.clear()
+        return stats
+
+
+def _cache_entry(resp, data, size, previous=None):
+    cache_control = resp.headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control:
+        return None
+    etag = resp.headers.get('ETag') or (previous and previous.etag)
+    last_modified = resp.headers.get('Last-Modified') or (previous and previous.last_modified)
+    max_age = 0
+    for directive in cache_control.split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'max-age' and value.isdigit():
+            max_age = min(int(value), HTTP_CACHE_MAX_TTL)
+    if 'no-cache' in cache_control:
+        max_age = 0
+    if not (etag or last_modified or max_age):
+        return None
+    return CacheEntry(data, etag, last_modified, time.monotonic() + max_age, size)
+
+
+def pick_tunnel():
+    """(port, proxies) for the next request: a healthy tunnel weighted by latency, else PROXIES.
+
+    Raises TunnelsDown without touching the network while every tunnel is down.
+    """
+    if not tunnel_pool:
+        return None, PROXIES
+    port = tunnel_pool.choose()
+    if port is None:
+        TUNNEL_REJECTIONS.inc()
+        raise TunnelsDown('No healthy tunnel')
+    proxy = f"socks5h://{os.getenv('TUNNEL_HOST_NAME')}:{port}"
+    return port, {'http': proxy, 'https': proxy}
+
+
+def tunnel_get(url, **kwargs):
+    """http_session.get through a picked tunnel; a tunnel that cannot connect is skipped for a while."""
+    port, proxies = pick_tunnel()
+    try:
+        return http_session.get(url, proxies=proxies, **kwargs)
+    except requests.ConnectionError:
+        if port is not None:
+            tunnel_pool.mark_down(port)
+        raise
+
+
 def request_json(url, extra):
-    resp = requests.get(url, headers=HEADERS, proxies=PROXIES, timeout=10)
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        outcome, data = _request_json(url, extra)
+        return data
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, cache=outcome)
+
+
+def _request_json(url, extra):
+    """Returns (cache outcome, decoded body)."""
+    entry = response_cache.get(url)
+    if entry and entry.expires > time.monotonic():
+        response_cache.record('hit')
+        logger.debug('Cache hit', extra={**extra, 'cache': 'hit'})
+        return 'hit', entry.data
+    headers = HEADERS
+    if entry:
+        headers = dict(HEADERS or {})
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+    resp = tunnel_get(url, headers=headers, timeout=10)
+    if entry and resp.status_code == 304:
+        response_cache.record('revalidated')
+        response_cache.put(url, _cache_entry(resp, entry.data, entry.size, entry) or entry)
+        logger.debug('Cache revalidated', extra={**extra, 'cache': 'revalidated'})
+        return 'revalidated', entry.data
     resp.raise_for_status()
+    response_cache.record('miss')
     data = resp.json()
+    if (fresh := _cache_entry(resp, data, len(resp.content))):
+        response_cache.put(url, fresh)
     logger.info('Retrieved data', extra={**extra, 'items_count': len(data.get('results', []))})
-    return data
+    return 'miss', data
 
 
-def extract_movies_tv():
-    items = []
-    for key, url in URLS.items():
+response_cache = ResponseCache(HTTP_CACHE_MAX_BYTES)
+
+
+async def run_blocking(func, *args):
+    """Await func(*args) on io_pool (asyncio.to_thread would use the loop's per-run executor)."""
+    return await asyncio.get_running_loop().run_in_executor(io_pool, functools.partial(func, *args))
+
+
+async def _fetch_page(key, page, limiter, semaphore):
+    async with semaphore:
+        await limiter.acquire_async()
+        data = await run_blocking(
+            request_json, URLS[key].format(page=page), {'component': 'tmdb_api', 'category': key, 'page': page})
+    return key, page, data
+
+
+async def extract_movies_tv(limiter):
+    """Yield (media_type, page_data) for every favorites page as soon as it arrives."""
+    semaphore = asyncio.Semaphore(TMDB_PAGE_CONCURRENCY)
+    first_pages = await asyncio.gather(
+        *(_fetch_page(key, 1, limiter, semaphore) for key in URLS), return_exceptions=True)
+    rest = []
+    for key, result in zip(URLS, first_pages):
+        if isinstance(result, Exception):
+            logger.error('TMDB fetch failed', exc_info=result,
+                         extra={'component': 'tmdb_api', 'category': key, 'page': 1, 'error': str(result)})
+            continue
+        _, _, data = result
+        yield MEDIA_TYPES[key], data
+        rest.extend(asyncio.create_task(_fetch_page(key, page, limiter, semaphore))
+                    for page in range(2, int(data.get('total_pages') or 1) + 1))
+    for task in asyncio.as_completed(rest):
         try:
-            items.append(request_json(url, {'component': 'tmdb_api', 'category': key}))
+            key, _, data = await task
         except Exception as e:
             logger.error('TMDB fetch failed', exc_info=True,
-                         extra={'component': 'tmdb_api', 'category': key, 'error': str(e)})
+                         extra={'component': 'tmdb_api', 'error': str(e)})
+            continue
+        yield MEDIA_TYPES[key], data
+
+
+def extract_items(pages, seen=None):
+    """Turn favorites pages into FavoriteItem records, one per (media_type, id)."""
+    seen = set() if seen is None else seen
+    items = []
+    for media_type, data in pages:
+        for result in data.get('results', []):
+            if (pk := result.get('id')) and (media_type, pk) not in seen:
+                seen.add((media_type, pk))
+                items.append(FavoriteItem(media_type, pk, result.get('vote_average')))
     return items
 
 
-def extract_jpg_paths(id_dict):
-    posters = {}
-    templates = {
-        'movie': "https://api.themoviedb.org/3/movie/{}/images?language=ru",
-        'tv': "https://api.themoviedb.org/3/tv/{}/images?language=ru"
-    }
-    for mid, meta in id_dict.items():
-        for cat, tmpl in templates.items():
-            try:
-                data = request_json(tmpl.format(mid), {'component': 'tmdb_api', 'movie_id': mid, 'category': cat})
-                if not data.get('success') and data.get('posters'):
-                    posters[mid] = [data['posters'][0].get('file_path'), meta]
+async def _fetch_poster_path(item, limiter, semaphore):
+    url = IMAGE_TEMPLATES[item.media_type].format(item.id)
+    async with semaphore:
+        await limiter.acquire_async()
+        try:
+            data = await run_blocking(
+                request_json, url, {'component': 'tmdb_api', 'movie_id': item.id, 'category': item.media_type})
+        except Exception:
+            return item, None
+    if not data.get('success') and data.get('posters'):
+        return item, data['posters'][0].get('file_path')
+    # Answered, but without a poster: '' (a failed lookup is None).
+    return item, ''
+
+
+def filter_unknown(items):
+    """Drop items already stored or archived (one round trip per batch) or recently found without a poster.
+
+    Items known only by their bare id (stored before poster ids carried the
+    media type) are re-keyed on the way; if a movie and a tv show share that
+    id, the first one adopts the old record and the other counts as new.
+    Records the Telegram service is publishing right now are re-keyed on a
+    later cycle; until then their items are skipped.
+    """
+    if not items:
+        return items
+    keys = [item.key for item in items]
+    known = exists_many(redis_batch, keys + [str(item.id) for item in items])
+    typed, legacy = known[:len(items)], known[len(items):]
+    candidates = [item for item, is_known, is_legacy in zip(items, typed, legacy) if is_legacy and not is_known]
+    adopted, deferred = adopt_legacy(candidates)
+    rekeyed = {key.decode() for key in adopted + deferred}
+    now = time.time()
+    missing = [score is not None and score > now for score in redis_client.zmscore(MISSING_KEY, keys)]
+    return [item for item, is_known, is_missing in zip(items, typed, missing)
+            if not (is_known or is_missing) and item.key not in rekeyed]
+
+
+def mark_missing(items):
+    """Remember favorites without a poster for TMDB_MISSING_TTL seconds (and drop expired entries)."""
+    if not items:
+        return
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.zadd(MISSING_KEY, {item.key: now + TMDB_MISSING_TTL for item in items})
+    pipe.zremrangebyscore(MISSING_KEY, '-inf', now)
+    pipe.execute()
+    logger.info('Favorites without a poster', extra={'component': 'tmdb_api', 'count': len(items),
+                                                      'retry_in_s': TMDB_MISSING_TTL})
+
+
+def adopt_legacy(items):
+    """Re-key the bare-id records of items as media_type:id; returns the poster ids (adopted, deferred)."""
+    if not items:
+        return [], []
+    records = []
+    for item in items:
+        old, new = str(item.id), item.key
+        records.append((new, POSTER_KEY.format(old), POSTER_KEY.format(new),
+                        *archive_location(old)[:1], *archive_location(new)))
+    adopted, deferred = redis_batch.adopt_legacy(INFLIGHT_KEY, (PENDING_KEY, RETRY_KEY, DEAD_KEY), records)
+    if adopted or deferred:
+        logger.info('Legacy poster ids re-keyed', extra={'component': 'redis', 'count': len(adopted),
+                                                         'deferred': len(deferred)})
+    return adopted, deferred
+
+
+def claim_items(items):
+    """Keep the items this replica has claimed; another replica is handling the rest."""
+    if not items:
+        return items
+    claimed = set(claim_many(redis_client, [CLAIM_KEY.format(item.key) for item in items], TMDB_CLAIM_TTL))
+    return [item for item in items if CLAIM_KEY.format(item.key) in claimed]
+
+
+def release_items(items):
+    release_many(redis_client, [CLAIM_KEY.format(item.key) for item in items])
+
+
+def drop_known_index():
+    """Free the per-poster known set of earlier releases; hashes and the archive answer the same question."""
+    if redis_client.unlink(LEGACY_KNOWN_KEY):
+        logger.info('Known index dropped', extra={'component': 'redis'})
+
+
+def _posters_from(results):
+    return {item.key: (path, item.vote_average) for item, path in results if path}
+
+
+async def collect_posters(claimed=None):
+    """Stream new (not yet known) favorites into poster resolution while pages are still loading.
+
+    Only items this replica claims are resolved; they are appended to claimed.
+    """
+    limiter = TokenBucket(TMDB_RATE_LIMIT, TMDB_RATE_BURST)
+    semaphore = asyncio.Semaphore(TMDB_CONCURRENCY)
+    seen, lookups = set(), []
+    claimed = [] if claimed is None else claimed
+    async for page in extract_movies_tv(limiter):
+        items = await run_blocking(
+            lambda: claim_items(filter_unknown(extract_items([page], seen))))
+        claimed.extend(items)
+        lookups.extend(asyncio.create_task(_fetch_poster_path(item, limiter, semaphore)) for item in items)
+    results = await asyncio.gather(*lookups)
+    await run_blocking(mark_missing, [item for item, path in results if path == ''])
+    return _posters_from(results)
+
+
+def poster_filename(path):
+    return path.lstrip('/').replace('/', '')
+
+
+def _is_complete_jpeg(filepath):
+    try:
+        if os.path.getsize(filepath) < 4:
+            return False
+        with open(filepath, 'rb') as f:
+            f.seek(-2, os.SEEK_END)
+            return f.read(2) == JPEG_EOI
+    except OSError:
+        return False
+
+
+def pick_poster_size(sizes, width):
+    widths = sorted(int(size[1:]) for size in sizes if size[:1] == 'w' and size[1:].isdigit())
+    for w in widths:
+        if w >= width:
+            return f"w{w}"
+    return 'original' if 'original' in sizes or not widths else f"w{widths[-1]}"
+
+
+def poster_base_url():
+    """Base URL of the chosen poster variant, from /configuration refreshed daily."""
+    global image_base, image_base_expires
+    if image_base and time.monotonic() < image_base_expires:
+        return image_base
+    try:
+        images = request_json(CONFIGURATION_URL, {'component': 'tmdb_api', 'category': 'configuration'})['images']
+        sizes = images['poster_sizes']
+        size = POSTER_SIZE if POSTER_SIZE in sizes else pick_poster_size(sizes, POSTER_WIDTH)
+        image_base = f"{images['secure_base_url'].rstrip('/')}/{size}"
+        image_base_expires = time.monotonic() + IMAGE_CONFIG_TTL
+    except Exception as e:
+        logger.warning('TMDB configuration unavailable', exc_info=True,
+                       extra={'component': 'tmdb_api', 'category': 'configuration', 'error': str(e)})
+    return image_base or DEFAULT_IMAGE_BASE
+
+
+def fit_poster(filepath, max_bytes):
+    """Re-encode the JPEG at filepath until it fits max_bytes; returns the new size.
+
+    Runs in the encode process pool.
+    """
+    size = os.path.getsize(filepath)
+    if size <= max_bytes:
+        return size
+    with Image.open(filepath) as img:
+        img = img.convert('RGB')
+        for scale in (1.0, 0.85, 0.7, 0.5):
+            frame = img if scale == 1.0 else img.resize(
+                (int(img.width * scale), int(img.height * scale)), Image.LANCZOS)
+            for quality in (85, 75, 65, 55):
+                buf = io.BytesIO()
+                frame.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+                if buf.tell() <= max_bytes:
                     break
-            except Exception:
+            else:
                 continue
-    return posters
+            break
+    if buf.tell() < size:
+        with open(filepath, 'wb') as f:
+            f.write(buf.getvalue())
+    return min(buf.tell(), size)
+
+
+def store_poster(mid, path, base_url=DEFAULT_IMAGE_BASE):
+    """Stream one poster into jpgs/ via a temp file and an atomic rename."""
+    filename = poster_filename(path)
+    target = os.path.join(POSTERS_DIR, filename)
+    if _is_complete_jpeg(target):
+        logger.debug('Poster already stored', extra={'component': 'downloader', 'movie_id': mid, 'file': filename})
+        if poster_cache:
+            poster_cache.touch(filename)
+        return filename
+    tmp = f"{target}.{uuid.uuid4().hex}.part"
+    try:
+        with tunnel_get(f"{base_url}{path}", timeout=30, stream=True) as resp:
+            resp.raise_for_status()
+            written = 0
+            with open(tmp, 'wb') as f:
+                for chunk in resp.iter_content(POSTER_CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            expected = resp.headers.get('Content-Length')
+            if expected and 'Content-Encoding' not in resp.headers and written != int(expected):
+                raise IOError(f"Truncated poster: {written} of {expected} bytes")
+        if encode_pool and written > POSTER_MAX_BYTES:
+            written = encode_pool.submit(fit_poster, tmp, POSTER_MAX_BYTES).result()
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    logger.info('Poster saved', extra={'component': 'downloader', 'movie_id': mid, 'file': filename, 'bytes': written})
+    return filename
 
 
 def download_posters(posters):
-    os.makedirs('jpgs', exist_ok=True)
-    for mid, (path, _) in posters.items():
-        url = f"https://image.tmdb.org/t/p/w500{path}"
-        resp = requests.get(url, proxies=PROXIES, timeout=30)
-        resp.raise_for_status()
-        filename = path.lstrip('/').replace('/', '')
-        with open(os.path.join('jpgs', filename), 'wb') as f:
-            f.write(resp.content)
-        logger.info('Poster saved', extra={'component': 'downloader', 'movie_id': mid, 'file': filename})
-
-
-def group_ids(data_list):
-    result = {}
-    def recurse(data):
-        if isinstance(data, dict):
-            if (pk := data.get('id')):
-                result.setdefault(pk, []).append(data)
-            for v in data.values(): recurse(v)
-        elif isinstance(data, list):
-            for i in data: recurse(i)
-    recurse(data_list)
-    return {k: [d.get('vote_average') for d in v] for k, v in result.items()}
-
-
-def push_to_redis(posters):
-    for mid, (path, meta) in posters.items():
-        key = f"poster:{mid}"
-        if not redis_client.exists(key):
-            redis_client.hset(key, mapping={'jpg': path.lstrip('/'), 'vote_average': str(meta[0]), 'status': 'ready'})
-            logger.info('Added to Redis', extra={'component': 'redis', 'movie_id': mid})
+    """Store posters concurrently; returns the subset that is safely on disk."""
+    os.makedirs(POSTERS_DIR, exist_ok=True)
+    base_url = poster_base_url()
+
+    def download(mid, path):
+        start = time.perf_counter()
+        try:
+            store_poster(mid, path, base_url)
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - start, outcome='stored')
+            return True
+        except TunnelsDown:
+            # Already counted and logged once per job; the poster is retried next cycle.
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - start, outcome='failed')
+            return False
+        except Exception as e:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - start, outcome='failed')
+            logger.error('Poster download failed', exc_info=True,
+                         extra={'component': 'downloader', 'movie_id': mid, 'error': str(e)})
+            return False
+
+    done = download_pool.map(download, posters.keys(), (path for path, _ in posters.values()))
+    stored = {mid: poster for (mid, poster), ok in zip(posters.items(), done) if ok}
+    if poster_cache:
+        # This job's posters are not in the pending set until push_to_redis.
+        new = {poster_filename(path) for path, _ in stored.values()}
+        poster_cache.enforce(lambda: pinned_files(redis_client) | new)
+    return stored
+
+
+def push_to_redis(posters, base_url=DEFAULT_IMAGE_BASE):
+    """Insert new poster hashes and queue them for publishing in one atomic script.
+
+    Each record carries the poster's URL in the chosen variant, which the
+    Telegram service sends when it does not upload the file.
+    """
+    if not posters:
+        return
+    records = {POSTER_KEY.format(poster_id): {'jpg': path.lstrip('/'), 'url': f"{base_url}{path}",
+                                              'vote_average': str(vote_average), 'status': 'ready'}
+               for poster_id, (path, vote_average) in posters.items()}
+    pipe = redis_batch.pipeline()
+    # Published posters only live on in the archive, so the script checks
+    # there too to keep them from coming back.
+    redis_batch.queue_insert_if_absent(pipe, records, index=PENDING_KEY, score=time.time(),
+                                       archive=[archive_location(poster_id) for poster_id in posters])
+    inserted, = redis_batch.execute(pipe, 'push_posters', len(records))
+    POSTERS_ADDED.inc(len(inserted))
+    for key in inserted:
+        logger.info('Added to Redis', extra={'component': 'redis', 'movie_id': key.decode().split(':', 1)[1]})
+    if inserted:
+        # Wake the Telegram service; the list never holds more than one token.
+        pipe = redis_batch.pipeline()
+        pipe.lpush(NOTIFY_KEY, 1)
+        pipe.ltrim(NOTIFY_KEY, 0, 0)
+        redis_batch.execute(pipe, 'notify', len(inserted))
 
 
 def main_job():
+    """One fetch cycle; returns how many new posters it found, or None if it did not run to the end."""
     job_id = str(uuid.uuid4())
+    if tunnel_pool and not tunnel_pool.healthy():
+        logger.warning('Job skipped, no healthy tunnel', extra={'component': 'scheduler', 'job_id': job_id})
+        JOB_SECONDS.observe(0, outcome='skipped')
+        return
     logger.info('Job start', extra={'component': 'scheduler', 'job_id': job_id})
+    start = time.perf_counter()
+    claimed = []
     try:
-        data = extract_movies_tv()
-        if not data: return
-        ids = group_ids(data)
-        posters = extract_jpg_paths(ids)
+        posters = asyncio.run(collect_posters(claimed))
         if posters:
-            download_posters(posters)
-            push_to_redis(posters)
+            push_to_redis(download_posters(posters) if DOWNLOAD_POSTERS else posters, poster_base_url())
         logger.info('Job done', extra={'component': 'scheduler', 'job_id': job_id, 'count': len(posters)})
+        logger.info('HTTP cache stats', extra={'component': 'http_cache', 'job_id': job_id, **response_cache.stats()})
+        JOB_SECONDS.observe(time.perf_counter() - start, outcome='ok')
+        return len(posters)
     except Exception as e:
+        JOB_SECONDS.observe(time.perf_counter() - start, outcome='failed')
         logger.critical('Job failed', exc_info=True,
                         extra={'component': 'scheduler', 'job_id': job_id, 'error': str(e)})
+    finally:
+        # Stored posters are known by now; the rest are free for the next cycle.
+        if claimed:
+            release_items(claimed)
+
+
+def reconcile_posters():
+    """Remove files in jpgs/ that no unpublished poster references (published, or never recorded)."""
+    os.makedirs(POSTERS_DIR, exist_ok=True)
+    try:
+        poster_cache.reconcile(pinned_files(redis_client))
+    except Exception as e:
+        logger.error('Poster cache reconciliation failed', exc_info=True,
+                     extra={'component': 'poster_cache', 'error': str(e)})
 
 
 def health_check():
@@ -194,26 +666,36 @@ def health_check():
 
 
 def init():
-    global HEADERS, PROXIES, redis_client
+    global HEADERS, PROXIES, redis_client, redis_batch, http_session, encode_pool, tunnel_pool, poster_cache
     load_dotenv()
     HEADERS = {'accept': 'application/json', 'Authorization': f"Bearer {os.getenv('TMDB_ACCOUNT_BEARER')}"}
     PROXIES = {'http': f"socks5h://{os.getenv('TUNNEL_HOST_NAME')}:{os.getenv('TUNNEL_PORT')}", 
                'https': f"socks5h://{os.getenv('TUNNEL_HOST_NAME')}:{os.getenv('TUNNEL_PORT')}"}
     redis_client = get_redis_client()
+    redis_batch = RedisBatch(redis_client)
+    tunnel_pool = TunnelPool(redis_client, fallback=[os.getenv('TUNNEL_PORT')])
+    http_session = get_http_session()
+    poster_cache = PosterCache(POSTERS_DIR, POSTER_CACHE_MAX_BYTES, POSTER_CACHE_MAX_FILES)
+    if POSTER_MAX_BYTES and Image is None:
+        logger.warning('POSTER_MAX_BYTES set but Pillow is not installed; posters are stored as downloaded',
+                       extra={'component': 'downloader'})
+    elif POSTER_MAX_BYTES:
+        encode_pool = ProcessPoolExecutor(max_workers=POSTER_ENCODE_WORKERS)
 
 if __name__ == '__main__':
     init()
-    logger = setup_logging()
-    logger.addFilter(RequestContextFilter())
+    metrics.start_metrics_server(METRICS_PORT)
 
     if not health_check(): logger.warning('Starting degraded')
-    main_job()
-    schedule.every(40).seconds.do(main_job)
-    schedule.every(30).seconds.do(health_check)
+    drop_known_index()
+    if DOWNLOAD_POSTERS:
+        reconcile_posters()
+    scheduler = Scheduler()
+    scheduler.every(TMDB_JOB_INTERVAL, main_job, minimum=TMDB_JOB_MIN_INTERVAL,
+                    maximum=TMDB_JOB_MAX_INTERVAL, run_now=True)
+    scheduler.every(30, health_check)
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        scheduler.run_forever()
     except KeyboardInterrupt:
         logger.info('Shutdown')
     except Exception:
@@ -1,8 +1,9 @@
 import os
+import asyncio
 import pytest
 import redis
 import requests
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, call
 from . import dev_tmdb
 
 @pytest.fixture(autouse=True)
@@ -23,13 +24,18 @@ def mock_redis(mocker):
     return instance
 
 @pytest.fixture
-def mock_requests(mocker):
-    mock = mocker.patch("requests.get")
+def mock_requests(monkeypatch):
+    session = MagicMock()
     response = MagicMock()
+    response.status_code = 200
+    response.headers = {}
+    response.content = b'{"results": [1, 2, 3]}'
     response.json.return_value = {"results": [1, 2, 3]}
     response.raise_for_status.return_value = None
-    mock.return_value = response
-    return mock
+    session.get.return_value = response
+    monkeypatch.setattr(dev_tmdb, 'http_session', session)
+    monkeypatch.setattr(dev_tmdb, 'response_cache', dev_tmdb.ResponseCache(1024))
+    return session.get
 
 def test_get_redis_client_success(mocker):
     # Create a mock Redis instance
@@ -70,6 +76,40 @@ def test_request_json_uses_proxy_and_headers(mock_requests, monkeypatch):
         timeout=10
     )
 
+def test_request_json_revalidates_with_etag(mock_requests, monkeypatch):
+    monkeypatch.setattr(dev_tmdb, 'HEADERS', {'Authorization': 'Bearer testtoken'})
+    response = mock_requests.return_value
+    response.headers = {'ETag': '"v1"'}
+
+    first = dev_tmdb.request_json("http://example.com", {})
+    response.status_code = 304
+    response.headers = {}
+    response.json.side_effect = AssertionError("304 must not be parsed")
+
+    assert dev_tmdb.request_json("http://example.com", {}) is first
+    assert mock_requests.call_args.kwargs['headers'] == {
+        'Authorization': 'Bearer testtoken', 'If-None-Match': '"v1"'}
+    assert dev_tmdb.response_cache.stats() == {
+        'hits': 0, 'misses': 1, 'revalidated': 1, 'entries': 1, 'bytes': len(response.content)}
+
+def test_request_json_serves_fresh_entries_from_cache(mock_requests):
+    mock_requests.return_value.headers = {'Cache-Control': 'public, max-age=60'}
+
+    dev_tmdb.request_json("http://example.com", {})
+    dev_tmdb.request_json("http://example.com", {})
+    assert mock_requests.call_count == 1
+    assert dev_tmdb.response_cache.stats()['hits'] == 1
+
+def test_response_cache_evicts_least_recently_used():
+    cache = dev_tmdb.ResponseCache(max_bytes=10)
+    entry = dev_tmdb.CacheEntry({}, '"e"', None, 0, 4)
+    cache.put('a', entry)
+    cache.put('b', entry)
+    cache.get('a')
+    cache.put('c', entry)
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.size == 8
+
 def test_request_json_failure(mocker, monkeypatch):
     monkeypatch.setattr(dev_tmdb, 'HEADERS', {'Authorization': 'Bearer testtoken'})
     monkeypatch.setattr(dev_tmdb, 'PROXIES', {
@@ -77,12 +117,29 @@ def test_request_json_failure(mocker, monkeypatch):
         'https': 'socks5h://127.0.0.1:1089'
     })
     
-    mocker.patch("requests.get", side_effect=requests.RequestException("Failed"))
+    session = mocker.patch.object(dev_tmdb, "http_session")
+    session.get.side_effect = requests.RequestException("Failed")
     mocker.patch.object(dev_tmdb, "logger")
     
     with pytest.raises(requests.RequestException):
         dev_tmdb.request_json("http://example.com", {})
 
+def test_get_http_session_pools_through_proxy(monkeypatch):
+    proxies = {
+        'http': 'socks5h://127.0.0.1:1089',
+        'https': 'socks5h://127.0.0.1:1089'
+    }
+    monkeypatch.setattr(dev_tmdb, 'PROXIES', proxies)
+    monkeypatch.setattr(dev_tmdb, 'HTTP_POOL_CONNECTIONS', 2)
+    monkeypatch.setattr(dev_tmdb, 'HTTP_POOL_MAXSIZE', 8)
+
+    session = dev_tmdb.get_http_session()
+    adapter = session.get_adapter("https://api.themoviedb.org/3")
+    assert session.proxies == proxies
+    assert adapter._pool_connections == 2
+    assert adapter._pool_maxsize == 8
+    assert session.get_adapter("https://image.tmdb.org/t/p") is adapter
+
 def test_health_check_success(mocker):
     mocker.patch('tmdb.dev_tmdb.get_redis_client').return_value.ping.return_value = True
     dev_tmdb.redis_client = dev_tmdb.get_redis_client()
@@ -94,3 +151,370 @@ def test_health_check_failure(mocker):
     # Need to set redis_client for the test
     dev_tmdb.redis_client = mock_redis.return_value
     assert dev_tmdb.health_check() is False
+
+def test_extract_items_keeps_media_type():
+    pages = [
+        ('movie', {'results': [{'id': 1, 'vote_average': 7.5, 'genre_ids': [{'id': 99}]},
+                               {'id': 2, 'vote_average': 6.0}]}),
+        ('tv', {'results': [{'id': 1, 'vote_average': 8.1}]}),
+    ]
+    items = dev_tmdb.extract_items(pages)
+    assert items == [
+        dev_tmdb.FavoriteItem('movie', 1, 7.5),
+        dev_tmdb.FavoriteItem('movie', 2, 6.0),
+        dev_tmdb.FavoriteItem('tv', 1, 8.1),
+    ]
+
+def test_collect_posters_one_lookup_per_item(mocker, monkeypatch, empty_known_index):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+
+    def fake_request_json(url, extra):
+        if 'favorite' in url:
+            ids = [1, 3] if extra['category'] == 'movies' else [2]
+            return {'total_pages': 1, 'results': [{'id': i, 'vote_average': 7.5} for i in ids]}
+        if '/movie/1/' in url:
+            return {'posters': [{'file_path': '/movie1.jpg'}]}
+        if '/tv/2/' in url:
+            return {'posters': [{'file_path': '/tv2.jpg'}]}
+        raise requests.HTTPError("404")
+
+    request = mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+
+    posters = asyncio.run(dev_tmdb.collect_posters())
+    assert posters == {'movie:1': ('/movie1.jpg', 7.5), 'tv:2': ('/tv2.jpg', 7.5)}
+    assert len([c for c in request.call_args_list if 'favorite' not in c.args[0]]) == 3
+
+def test_collect_posters_bounds_lookup_concurrency(mocker, monkeypatch, empty_known_index):
+    import threading
+    import time as _time
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0}
+
+    def slow_request_json(url, extra):
+        if 'favorite' in url:
+            results = [{'id': i, 'vote_average': 5.0} for i in range(1, 13)] if extra['category'] == 'movies' else []
+            return {'total_pages': 1, 'results': results}
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        _time.sleep(0.01)
+        with lock:
+            state['active'] -= 1
+        return {'posters': [{'file_path': '/p.jpg'}]}
+
+    monkeypatch.setattr(dev_tmdb, 'TMDB_CONCURRENCY', 3)
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+    mocker.patch.object(dev_tmdb, 'request_json', side_effect=slow_request_json)
+
+    posters = asyncio.run(dev_tmdb.collect_posters())
+    assert len(posters) == 12
+    assert state['peak'] <= 3
+
+@pytest.fixture
+def empty_known_index(monkeypatch):
+    client = MagicMock()
+    monkeypatch.setattr(dev_tmdb, 'exists_many', lambda batch, ids: [False] * len(ids))
+    client.zmscore.side_effect = lambda key, ids: [None] * len(ids)
+    monkeypatch.setattr(dev_tmdb, 'redis_client', client)
+    monkeypatch.setattr(dev_tmdb, 'claim_many', lambda client, keys, ttl: keys)
+    return client
+
+def test_collect_posters_fetches_all_pages(mocker, monkeypatch, empty_known_index):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+    pages = {
+        ('movies', 1): {'page': 1, 'total_pages': 3, 'results': [{'id': 1, 'vote_average': 7.0}]},
+        ('movies', 2): {'page': 2, 'total_pages': 3, 'results': [{'id': 2, 'vote_average': 6.5}]},
+        ('movies', 3): {'page': 3, 'total_pages': 3, 'results': [{'id': 3, 'vote_average': 5.5}]},
+        ('tv', 1): {'page': 1, 'total_pages': 1, 'results': [{'id': 10, 'vote_average': 9.0}]},
+    }
+
+    def fake_request_json(url, extra):
+        if 'favorite' in url:
+            return pages[(extra['category'], extra['page'])]
+        return {'posters': [{'file_path': f"/{extra['category']}{extra['movie_id']}.jpg"}]}
+
+    request = mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+
+    posters = asyncio.run(dev_tmdb.collect_posters())
+    assert posters == {
+        'movie:1': ('/movie1.jpg', 7.0),
+        'movie:2': ('/movie2.jpg', 6.5),
+        'movie:3': ('/movie3.jpg', 5.5),
+        'tv:10': ('/tv10.jpg', 9.0),
+    }
+    assert request.call_count == 8
+
+def test_collect_posters_skips_failed_pages(mocker, monkeypatch, empty_known_index):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+    mocker.patch.object(dev_tmdb, 'logger')
+
+    def fake_request_json(url, extra):
+        if extra['category'] == 'tv' or extra.get('page') == 2:
+            raise requests.HTTPError("500")
+        if 'favorite' in url:
+            return {'total_pages': 2, 'results': [{'id': 1, 'vote_average': 7.0}]}
+        return {'posters': [{'file_path': '/p.jpg'}]}
+
+    mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+
+    assert asyncio.run(dev_tmdb.collect_posters()) == {'movie:1': ('/p.jpg', 7.0)}
+
+def test_collect_posters_skips_items_claimed_by_another_replica(mocker, monkeypatch, empty_known_index):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+    monkeypatch.setattr(dev_tmdb, 'claim_many', lambda client, keys, ttl: [k for k in keys if k != 'claim:movie:1'])
+
+    def fake_request_json(url, extra):
+        if 'favorite' in url:
+            results = [] if extra['category'] == 'tv' else [{'id': 1, 'vote_average': 7.0}, {'id': 2, 'vote_average': 6.0}]
+            return {'total_pages': 1, 'results': results}
+        return {'posters': [{'file_path': f"/{extra['movie_id']}.jpg"}]}
+
+    mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+    claimed = []
+    assert asyncio.run(dev_tmdb.collect_posters(claimed)) == {'movie:2': ('/2.jpg', 6.0)}
+    assert [item.id for item in claimed] == [2]
+
+def test_collect_posters_skips_known_ids(mocker, monkeypatch):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+    client = MagicMock()
+    checked = []
+
+    def exists_many(batch, ids):
+        checked.append(ids)
+        return [i == 'movie:1' for i in ids]
+
+    monkeypatch.setattr(dev_tmdb, 'exists_many', exists_many)
+    client.zmscore.side_effect = lambda key, ids: [None] * len(ids)
+    monkeypatch.setattr(dev_tmdb, 'redis_client', client)
+    monkeypatch.setattr(dev_tmdb, 'claim_many', lambda client, keys, ttl: keys)
+
+    def fake_request_json(url, extra):
+        if 'favorite' in url:
+            if extra['category'] == 'tv':
+                return {'total_pages': 1, 'results': []}
+            return {'total_pages': 1, 'results': [{'id': 1, 'vote_average': 7.0},
+                                                  {'id': 2, 'vote_average': 6.0}]}
+        return {'posters': [{'file_path': f"/{extra['movie_id']}.jpg"}]}
+
+    request = mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+
+    assert asyncio.run(dev_tmdb.collect_posters()) == {'movie:2': ('/2.jpg', 6.0)}
+    assert request.call_count == 3
+    assert checked == [['movie:1', 'movie:2', '1', '2']]
+
+def test_movie_and_tv_show_sharing_an_id_are_both_stored(mocker, monkeypatch, empty_known_index):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+
+    def fake_request_json(url, extra):
+        if 'favorite' in url:
+            return {'total_pages': 1, 'results': [{'id': 42, 'vote_average': 7.0}]}
+        return {'posters': [{'file_path': f"/{extra['category']}42.jpg"}]}
+
+    mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+    posters = asyncio.run(dev_tmdb.collect_posters())
+    assert posters == {'movie:42': ('/movie42.jpg', 7.0), 'tv:42': ('/tv42.jpg', 7.0)}
+
+    batch = MagicMock()
+    batch.execute.return_value = [[b'poster:movie:42', b'poster:tv:42']]
+    monkeypatch.setattr(dev_tmdb, 'redis_batch', batch)
+    dev_tmdb.push_to_redis(posters)
+    records = batch.queue_insert_if_absent.call_args.args[1]
+    base = dev_tmdb.DEFAULT_IMAGE_BASE
+    assert records == {'poster:movie:42': {'jpg': 'movie42.jpg', 'url': f'{base}/movie42.jpg', 'vote_average': '7.0', 'status': 'ready'},
+                       'poster:tv:42': {'jpg': 'tv42.jpg', 'url': f'{base}/tv42.jpg', 'vote_average': '7.0', 'status': 'ready'}}
+    assert batch.queue_insert_if_absent.call_args.kwargs['archive'] == [('posters:archive:movie:0', 42),
+                                                                        ('posters:archive:tv:0', 42)]
+
+def test_filter_unknown_rekeys_legacy_ids_once(monkeypatch):
+    client = MagicMock()
+    # Bare id 42 is known from before ids carried the media type.
+    monkeypatch.setattr(dev_tmdb, 'exists_many', lambda batch, ids: [i == '42' for i in ids])
+    client.zmscore.side_effect = lambda key, ids: [None] * len(ids)
+    batch = MagicMock()
+    batch.adopt_legacy.return_value = ([b'movie:42'], [])
+    monkeypatch.setattr(dev_tmdb, 'redis_client', client)
+    monkeypatch.setattr(dev_tmdb, 'redis_batch', batch)
+    monkeypatch.setattr(dev_tmdb, 'logger', MagicMock())
+
+    items = [dev_tmdb.FavoriteItem('movie', 42, 7.0), dev_tmdb.FavoriteItem('tv', 42, 7.0)]
+    assert dev_tmdb.filter_unknown(items) == [items[1]]
+    inflight, indexes, records = batch.adopt_legacy.call_args.args
+    assert inflight == dev_tmdb.INFLIGHT_KEY and inflight not in indexes
+    assert records[0] == ('movie:42', 'poster:42', 'poster:movie:42', 'posters:archive:0', 'posters:archive:movie:0', 42)
+    assert [record[0] for record in records] == ['movie:42', 'tv:42']
+
+    # While tg publishes poster:42 neither item is re-keyed nor treated as new.
+    batch.adopt_legacy.return_value = ([], [b'movie:42', b'tv:42'])
+    assert dev_tmdb.filter_unknown(items) == []
+
+def test_favorites_without_a_poster_are_not_looked_up_again_until_they_expire(mocker, monkeypatch,
+                                                                             empty_known_index):
+    monkeypatch.setattr(dev_tmdb, 'TMDB_RATE_LIMIT', 1000)
+    monkeypatch.setattr(dev_tmdb, 'TMDB_MISSING_TTL', 3600)
+    monkeypatch.setattr(dev_tmdb.time, 'time', lambda: 1700000000.0)
+
+    def fake_request_json(url, extra):
+        if 'favorite' in url:
+            results = [] if extra['category'] == 'tv' else [{'id': 1, 'vote_average': 7.0}, {'id': 2, 'vote_average': 6.0}]
+            return {'total_pages': 1, 'results': results}
+        if extra['movie_id'] == 1:
+            return {'posters': []}
+        raise requests.HTTPError("500")
+
+    mocker.patch.object(dev_tmdb, 'request_json', side_effect=fake_request_json)
+    assert asyncio.run(dev_tmdb.collect_posters()) == {}
+    # Only the answered lookup is remembered; the failed one is retried next cycle.
+    pipe = empty_known_index.pipeline.return_value
+    pipe.zadd.assert_called_once_with(dev_tmdb.MISSING_KEY, {'movie:1': 1700003600.0})
+    pipe.zremrangebyscore.assert_called_once_with(dev_tmdb.MISSING_KEY, '-inf', 1700000000.0)
+
+    scores = {'movie:1': 1700003600.0, 'movie:2': 1699999999.0}
+    empty_known_index.zmscore.side_effect = lambda key, ids: [scores.get(i) for i in ids]
+    items = [dev_tmdb.FavoriteItem('movie', 1, 7.0), dev_tmdb.FavoriteItem('movie', 2, 6.0)]
+    assert dev_tmdb.filter_unknown(items) == [items[1]]
+
+def test_push_to_redis_is_one_round_trip(monkeypatch):
+    batch = MagicMock()
+    pipe = batch.pipeline.return_value
+    batch.execute.return_value = [[b'poster:movie:5']]
+    monkeypatch.setattr(dev_tmdb, 'redis_batch', batch)
+    monkeypatch.setattr(dev_tmdb.time, 'time', lambda: 1700000000.0)
+
+    dev_tmdb.push_to_redis({'movie:5': ('/abc.jpg', 7.2), 'tv:5': ('/def.jpg', 6.1)},
+                           'https://image.tmdb.org/t/p/w342')
+    batch.queue_insert_if_absent.assert_called_once_with(pipe, {
+        'poster:movie:5': {'jpg': 'abc.jpg', 'url': 'https://image.tmdb.org/t/p/w342/abc.jpg',
+                           'vote_average': '7.2', 'status': 'ready'},
+        'poster:tv:5': {'jpg': 'def.jpg', 'url': 'https://image.tmdb.org/t/p/w342/def.jpg',
+                        'vote_average': '6.1', 'status': 'ready'},
+    }, index=dev_tmdb.PENDING_KEY, score=1700000000.0,
+        archive=[('posters:archive:movie:0', 5), ('posters:archive:tv:0', 5)])
+    assert batch.execute.call_args_list[0] == call(pipe, 'push_posters', 2)
+    pipe.lpush.assert_called_once_with(dev_tmdb.NOTIFY_KEY, 1)
+
+def test_push_to_redis_does_not_notify_without_inserts(monkeypatch):
+    batch = MagicMock()
+    batch.execute.return_value = [[]]
+    monkeypatch.setattr(dev_tmdb, 'redis_batch', batch)
+
+    dev_tmdb.push_to_redis({'movie:5': ('/abc.jpg', 7.2)})
+    batch.execute.assert_called_once()
+    batch.pipeline.return_value.lpush.assert_not_called()
+
+def _poster_response(chunks, headers=None):
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.headers = headers or {}
+    response.iter_content.return_value = iter(chunks)
+    return response
+
+def test_download_posters_streams_atomically_and_skips_stored(tmp_path, monkeypatch):
+    monkeypatch.setattr(dev_tmdb, 'POSTERS_DIR', str(tmp_path))
+    monkeypatch.setattr(dev_tmdb, 'logger', MagicMock())
+    session = MagicMock()
+    session.get.return_value = _poster_response([b'\xff\xd8', b'data', b'\xff\xd9'], {'Content-Length': '8'})
+    monkeypatch.setattr(dev_tmdb, 'http_session', session)
+    monkeypatch.setattr(dev_tmdb, 'poster_base_url', lambda: 'https://image.tmdb.org/t/p/w342')
+
+    stored = dev_tmdb.download_posters({1: ('/abc.jpg', 7.0)})
+    assert stored == {1: ('/abc.jpg', 7.0)}
+    assert (tmp_path / 'abc.jpg').read_bytes() == b'\xff\xd8data\xff\xd9'
+    assert os.listdir(tmp_path) == ['abc.jpg']
+    assert session.get.call_args.args == ('https://image.tmdb.org/t/p/w342/abc.jpg',)
+    assert session.get.call_args.kwargs['stream'] is True
+
+    assert dev_tmdb.download_posters({1: ('/abc.jpg', 7.0)}) == stored
+    assert session.get.call_count == 1
+
+def test_download_posters_drops_truncated_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(dev_tmdb, 'POSTERS_DIR', str(tmp_path))
+    monkeypatch.setattr(dev_tmdb, 'logger', MagicMock())
+    (tmp_path / 'abc.jpg').write_bytes(b'\xff\xd8partial')
+    session = MagicMock()
+    session.get.return_value = _poster_response([b'\xff\xd8', b'da'], {'Content-Length': '8'})
+    monkeypatch.setattr(dev_tmdb, 'http_session', session)
+    monkeypatch.setattr(dev_tmdb, 'poster_base_url', lambda: dev_tmdb.DEFAULT_IMAGE_BASE)
+
+    assert dev_tmdb.download_posters({1: ('/abc.jpg', 7.0)}) == {}
+    assert os.listdir(tmp_path) == ['abc.jpg']
+    assert (tmp_path / 'abc.jpg').read_bytes() == b'\xff\xd8partial'
+
+def test_download_posters_enforces_cache_cap_keeping_new_posters(tmp_path, monkeypatch, mocker):
+    monkeypatch.setattr(dev_tmdb, 'POSTERS_DIR', str(tmp_path))
+    monkeypatch.setattr(dev_tmdb, 'logger', MagicMock())
+    monkeypatch.setattr(dev_tmdb, 'poster_cache', dev_tmdb.PosterCache(str(tmp_path), max_files=1))
+    mocker.patch.object(dev_tmdb, 'pinned_files', return_value={'queued.jpg'})
+    (tmp_path / 'queued.jpg').write_bytes(b'\xff\xd8\xff\xd9')
+    (tmp_path / 'old.jpg').write_bytes(b'\xff\xd8\xff\xd9')
+    session = MagicMock()
+    session.get.return_value = _poster_response([b'\xff\xd8', b'\xff\xd9'])
+    monkeypatch.setattr(dev_tmdb, 'http_session', session)
+    monkeypatch.setattr(dev_tmdb, 'poster_base_url', lambda: dev_tmdb.DEFAULT_IMAGE_BASE)
+
+    assert dev_tmdb.download_posters({1: ('/abc.jpg', 7.0)}) == {1: ('/abc.jpg', 7.0)}
+    assert sorted(os.listdir(tmp_path)) == ['abc.jpg', 'queued.jpg']
+
+def test_poster_base_url_picks_smallest_wide_enough_size(mocker, monkeypatch):
+    monkeypatch.setattr(dev_tmdb, 'image_base', None)
+    monkeypatch.setattr(dev_tmdb, 'POSTER_WIDTH', 300)
+    request = mocker.patch.object(dev_tmdb, 'request_json', return_value={'images': {
+        'secure_base_url': 'https://image.tmdb.org/t/p/',
+        'poster_sizes': ['w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original']}})
+
+    assert dev_tmdb.poster_base_url() == 'https://image.tmdb.org/t/p/w342'
+    assert dev_tmdb.poster_base_url() == 'https://image.tmdb.org/t/p/w342'
+    request.assert_called_once()
+
+def test_poster_base_url_falls_back_without_configuration(mocker, monkeypatch):
+    monkeypatch.setattr(dev_tmdb, 'image_base', None)
+    mocker.patch.object(dev_tmdb, 'logger')
+    mocker.patch.object(dev_tmdb, 'request_json', side_effect=requests.ConnectionError("down"))
+
+    assert dev_tmdb.poster_base_url() == dev_tmdb.DEFAULT_IMAGE_BASE
+
+def test_fit_poster_shrinks_to_budget(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    import random
+    rng = random.Random(0)
+    img = Image.new('RGB', (500, 750))
+    img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(500 * 750)])
+    poster = tmp_path / 'p.jpg'
+    img.save(poster, 'JPEG', quality=95)
+    budget = os.path.getsize(poster) // 3
+
+    assert dev_tmdb.fit_poster(str(poster), budget) <= budget
+    assert os.path.getsize(poster) <= budget
+    assert poster.read_bytes().endswith(b'\xff\xd9')
+
+
+def test_requests_go_through_a_picked_tunnel_and_failing_tunnels_are_skipped(mock_requests, monkeypatch):
+    pool = MagicMock()
+    pool.choose.return_value = '1090'
+    monkeypatch.setattr(dev_tmdb, 'tunnel_pool', pool)
+    dev_tmdb.request_json("http://example.com/a", {})
+    assert mock_requests.call_args.kwargs['proxies'] == {
+        'http': 'socks5h://127.0.0.1:1090', 'https': 'socks5h://127.0.0.1:1090'}
+
+    mock_requests.side_effect = requests.ConnectionError('tunnel closed')
+    with pytest.raises(requests.ConnectionError):
+        dev_tmdb.request_json("http://example.com/b", {})
+    pool.mark_down.assert_called_once_with('1090')
+
+
+def test_requests_fail_fast_while_no_tunnel_is_healthy(mock_requests, monkeypatch):
+    pool = MagicMock()
+    pool.choose.return_value = None
+    monkeypatch.setattr(dev_tmdb, 'tunnel_pool', pool)
+    with pytest.raises(dev_tmdb.TunnelsDown):
+        dev_tmdb.request_json("http://example.com/a", {})
+    mock_requests.assert_not_called()
+
+
+def test_main_job_is_skipped_while_no_tunnel_is_healthy(monkeypatch):
+    pool = MagicMock()
+    pool.healthy.return_value = []
+    monkeypatch.setattr(dev_tmdb, 'tunnel_pool', pool)
+    collect = MagicMock()
+    monkeypatch.setattr(dev_tmdb, 'collect_posters', collect)
+    dev_tmdb.main_job()
+    collect.assert_not_called()
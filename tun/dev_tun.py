@@ -5,71 +5,26 @@ import os
 import time
 import socket
 import subprocess
-import logging
 import sys
 import socket
+import threading
 import uuid
-import traceback
-from pythonjsonlogger import jsonlogger
-
-class CustomJsonFormatter(jsonlogger.JsonFormatter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.hostname = socket.gethostname()
-        self.pod_name = os.getenv('POD_NAME', self.hostname)
-        self.namespace = os.getenv('POD_NAMESPACE', 'default')
-        self.service_name = os.getenv('SERVICE_NAME', 'tunnel-service')
-        self.app_version = os.getenv('APP_VERSION', '1.0.0')
-
-    def add_fields(self, log_record, record, message_dict):
-        super().add_fields(log_record, record, message_dict)
-        log_record.update({
-            'timestamp': record.created,
-            'level': record.levelname,
-            'logger': record.name,
-            'service': self.service_name,
-            'hostname': self.hostname,
-            'pod': self.pod_name,
-            'namespace': self.namespace,
-            'version': self.app_version,
-            'file': record.pathname,
-            'line': record.lineno,
-            'function': record.funcName,
-        })
-        if record.exc_info:
-            log_record['exception'] = traceback.format_exception(*record.exc_info)
-        if trace_id := getattr(record, 'trace_id', None):
-            log_record['trace_id'] = trace_id
-
-class RequestContextFilter(logging.Filter):
-    def __init__(self):
-        super().__init__()
-        self.trace_id = str(uuid.uuid4())
-
-    def filter(self, record):
-        record.trace_id = getattr(record, 'trace_id', self.trace_id)
-        return True
-
-def setup_logging():
-    level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logger = logging.getLogger()
-    logger.setLevel(level)
-    
-    for h in logger.handlers[:]:
-        logger.removeHandler(h)
-    
-    handler = logging.StreamHandler()
-    formatter = CustomJsonFormatter('%(timestamp)s %(level)s [%(service)s] [%(trace_id)s] %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    
-    logger.addFilter(RequestContextFilter())
-    for name in ('requests', 'urllib3', 'ssh'):
-        logging.getLogger(name).setLevel(logging.WARNING)
-    
-    return logger
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+from common import metrics
+from common.log import setup_logging
+from common.tunnels import publish_health
 
-logger = setup_logging()
+logger = setup_logging('tunnel-service', quiet=('requests', 'urllib3', 'ssh'))
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9103))
+PROBE_SECONDS = metrics.Histogram('tun_probe_seconds', 'Proxy check latency through the tunnel by outcome.',
+                                  ['port', 'outcome'])
+HANDSHAKE_SECONDS = metrics.Histogram('tun_handshake_seconds', 'SOCKS5 greeting plus CONNECT round trip through the tunnel.',
+                                      ['port'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2))
+TUNNEL_UP = metrics.Gauge('tun_up', 'Whether the last SOCKS probe through the tunnel succeeded.', ['port'])
 
 # Получение настроек из переменных окружения
 SSH_USER = os.environ.get("SSH_USER")
@@ -78,14 +33,51 @@ SSH_PORT = os.environ.get("SSH_PORT")
 TUNNEL_PORT = int(os.environ.get("TUNNEL_PORT"))  # используем значение по умолчанию, если переменная не задана
 SSH_PASS = os.environ.get("SSH_PASS")
 
-# Настройка прокси для requests
-PROXIES = {
-    'http': f'socks5h://127.0.0.1:{TUNNEL_PORT}',
-    'https': f'socks5h://127.0.0.1:{TUNNEL_PORT}'
-}
+# TUNNEL_COUNT tunnels listen on consecutive ports from TUNNEL_PORT, each its
+# own ssh process (and SSH connection), spread round-robin over SSH_HOSTS
+# (comma-separated, default SSH_HOST). Their health goes to Redis so tmdb
+# can route around slow or broken ones.
+SSH_HOSTS = [h.strip() for h in os.environ.get("SSH_HOSTS", SSH_HOST or "").split(",") if h.strip()]
+TUNNEL_COUNT = max(1, int(os.environ.get("TUNNEL_COUNT", 1)))
+TUNNELS = {TUNNEL_PORT + i: SSH_HOSTS[i % len(SSH_HOSTS)] if SSH_HOSTS else SSH_HOST for i in range(TUNNEL_COUNT)}
+CHECK_INTERVAL = int(os.environ.get("TUNNEL_CHECK_INTERVAL", 60))
+
+# Every PROBE_INTERVAL seconds each tunnel gets a SOCKS5 CONNECT to
+# PROBE_TARGET: one round trip through the SSH channel, so a dead tunnel is
+# noticed (and published) within about a second. The HTTPS check runs on
+# its own thread every CHECK_INTERVAL seconds.
+PROBE_INTERVAL = float(os.environ.get("TUNNEL_PROBE_INTERVAL", 1))
+PROBE_TIMEOUT = float(os.environ.get("TUNNEL_PROBE_TIMEOUT", 2))
+PROBE_TARGET = os.environ.get("TUNNEL_PROBE_TARGET", "api.themoviedb.org:443")
+# Published health expires in Redis after HEALTH_TTL seconds without a new
+# probe round; readers then treat every tunnel as down.
+HEALTH_TTL = float(os.environ.get("TUNNEL_HEALTH_TTL", 5))
+# Minimum seconds between restarts of the same tunnel.
+RESTART_BACKOFF = 10
+
+# port -> ssh process started for it
+processes = {}
+
+
+def proxies_for(port):
+    return {
+        'http': f'socks5h://127.0.0.1:{port}',
+        'https': f'socks5h://127.0.0.1:{port}'
+    }
+
+
+def get_redis_client():
+    """Client for publishing tunnel health, or None when REDIS_HOST is not configured."""
+    if not os.environ.get("REDIS_HOST"):
+        return None
+    return redis.Redis(host=os.environ["REDIS_HOST"], port=int(os.environ.get("REDIS_PORT", 6379)),
+                       db=int(os.environ.get("REDIS_DB", 0)), socket_timeout=5, socket_connect_timeout=5)
+
 
-def proxy_checker():
+def proxy_checker(port=TUNNEL_PORT):
+    """Fetch TARGET_URL through the tunnel on port; returns the latency in ms, or None on failure."""
     TARGET_URL = 'https://httpbin.org/ip'
+    PROXIES = proxies_for(port)
     trace_id = str(uuid.uuid4())
     extra = {
         'component': 'proxy_check',
@@ -95,12 +87,15 @@ def proxy_checker():
         'trace_id': trace_id
     }
     
+    start = time.perf_counter()
+    outcome = 'error'
     try:
         logger.info("Starting proxy check", extra=extra)
         response = requests.get(TARGET_URL, proxies=PROXIES, timeout=15)
         response.raise_for_status()
+        outcome = 'ok'
         
-        extra.update({'http_status': response.status_code})
+        extra.update({'http_status': response.status_code, 'latency_ms': round((time.perf_counter() - start) * 1000, 2)})
         
         try:
             data = response.json()
@@ -130,6 +125,9 @@ def proxy_checker():
     except Exception as e:
         logger.error("--- НЕПРЕДВИДЕННАЯ ОШИБКА ---")
         logger.error(f"Детали ошибки: {e}")
+    finally:
+        PROBE_SECONDS.observe(time.perf_counter() - start, port=port, outcome=outcome)
+    return round((time.perf_counter() - start) * 1000, 2) if outcome == 'ok' else None
 
 def is_port_in_use(host: str, port: int) -> bool:
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
@@ -140,49 +138,108 @@ def is_port_in_use(host: str, port: int) -> bool:
         except socket.error:
             return False
 
-def start_ssh_tunnel():
+def start_ssh_tunnel(port=TUNNEL_PORT, host=SSH_HOST):
     base_cmd = [
         "sshpass", "-p", f"{SSH_PASS}",
         "ssh", "-o", "StrictHostKeyChecking=no",
-        "-N", "-D", f"0.0.0.0:{TUNNEL_PORT}",
+        "-N", "-D", f"0.0.0.0:{port}",
         "-p", SSH_PORT,
-        f"{SSH_USER}@{SSH_HOST}"
+        f"{SSH_USER}@{host}"
     ]
     extra = {
         'component': 'ssh_tunnel',
         'operation': 'start_tunnel',
-        'tunnel_port': TUNNEL_PORT,
-        'ssh_host': SSH_HOST,
+        'tunnel_port': port,
+        'ssh_host': host,
         'ssh_port': SSH_PORT
     }
     
+    previous = processes.pop(port, None)
+    if previous and previous.poll() is None:
+        # Alive but not listening: replace it rather than stacking ssh processes.
+        previous.terminate()
     try:
-        subprocess.Popen(base_cmd)
+        processes[port] = subprocess.Popen(base_cmd)
         logger.info("SSH tunnel started", extra=extra)
     except Exception as e:
         logger.error("SSH tunnel startup failed",
                     extra={**extra, 'error': str(e)},
                     exc_info=True)
 
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("SOCKS proxy closed the connection")
+        data += chunk
+    return data
+
+def socks_probe(port, target=PROBE_TARGET, timeout=PROBE_TIMEOUT):
+    """SOCKS5 greeting plus CONNECT to target through the tunnel on port; returns the latency in ms, or None."""
+    host, _, target_port = target.rpartition(':')
+    connect = b'\x05\x01\x00\x03' + bytes([len(host)]) + host.encode() + int(target_port).to_bytes(2, 'big')
+    start = time.perf_counter()
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+            sock.sendall(b'\x05\x01\x00')
+            if _recv_exact(sock, 2) != b'\x05\x00':
+                return None
+            sock.sendall(connect)
+            # VER, REP: REP 0 means the remote side opened the connection.
+            if _recv_exact(sock, 2) != b'\x05\x00':
+                return None
+    except OSError:
+        return None
+    elapsed = time.perf_counter() - start
+    HANDSHAKE_SECONDS.observe(elapsed, port=port)
+    return round(elapsed * 1000, 2)
+
+def watch_tunnels(health_client):
+    """Probe every tunnel each PROBE_INTERVAL, restart the ones that are gone and publish their health."""
+    healthy = {}
+    started = {}
+    with ThreadPoolExecutor(max_workers=len(TUNNELS)) as probes:
+        while True:
+            round_start = time.monotonic()
+            states = {}
+            for port, latency_ms in zip(TUNNELS, probes.map(socks_probe, TUNNELS)):
+                up = latency_ms is not None
+                TUNNEL_UP.set(int(up), port=port)
+                states[port] = (up, latency_ms)
+                if up != healthy.get(port):
+                    healthy[port] = up
+                    extra = {'component': 'port_check', 'port': port, 'host': '127.0.0.1', 'latency_ms': latency_ms}
+                    if up:
+                        logger.info("Tunnel is up", extra=extra)
+                    else:
+                        logger.warning("Tunnel is down", extra=extra)
+                now = time.monotonic()
+                if (not up and now - started.get(port, -RESTART_BACKOFF) >= RESTART_BACKOFF
+                        and not is_port_in_use("127.0.0.1", port)):
+                    start_ssh_tunnel(port, TUNNELS[port])
+                    started[port] = now
+            if health_client is not None:
+                try:
+                    publish_health(health_client, states, HEALTH_TTL)
+                except redis.RedisError as e:
+                    logger.warning("Tunnel health not published",
+                                   extra={'component': 'health', 'error': str(e)})
+            time.sleep(max(0, PROBE_INTERVAL - (time.monotonic() - round_start)))
+
+def check_proxies():
+    """Full HTTPS request through every tunnel every CHECK_INTERVAL seconds."""
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        for port in TUNNELS:
+            proxy_checker(port)
+
 def main():
     logger.info("Starting SSH tunnel monitoring", 
-               extra={'component': 'main', 'operation': 'init'})
-    while True:
-        extra = {
-            'component': 'port_check',
-            'port': TUNNEL_PORT,
-            'host': '127.0.0.1'
-        }
-        
-        if is_port_in_use("127.0.0.1", TUNNEL_PORT):
-            logger.info("Tunnel port is active", extra=extra)
-            proxy_checker()
-        else:
-            logger.warning("Tunnel port not available", extra=extra)
-            start_ssh_tunnel()
-            proxy_checker()
-            
-        time.sleep(60)
+               extra={'component': 'main', 'operation': 'init', 'tunnels': len(TUNNELS)})
+    metrics.start_metrics_server(METRICS_PORT)
+    threading.Thread(target=check_proxies, name='proxy-check', daemon=True).start()
+    watch_tunnels(get_redis_client())
 
 if __name__ == "__main__":
     main()